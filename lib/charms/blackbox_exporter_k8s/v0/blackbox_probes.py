@@ -146,6 +146,20 @@ modules={
             }
         }
 
+Providers with many probes may opt into a compact wire format, in which the probes are
+LZMA-compressed, base64-encoded and optionally split across several databag keys, with
+`compression=True` and `chunk_size`:
+
+    self.probes_provider = BlackboxProbesProvider(
+        self,
+        probes=probes,
+        compression=True,
+        chunk_size=100_000,
+    )
+
+The compact format is only used with requirers advertising support for it; older requirers
+keep receiving the probes as plain JSON.
+
 ## Consumer Library Usage
 
 The `BlackboxProbesRequirer` object may be used by the Blackbox Exporter
@@ -197,15 +211,19 @@ exposes a `modules()` method that returns a dict of the new modules to be added
 Blackbox configuration file.
 """
 
+import binascii
 import logging
 import json
 import copy
 import hashlib
-from typing import Dict, List, Optional, Union, MutableMapping
+import lzma
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union, MutableMapping
 
 from ops import Object
 from ops.charm import CharmBase
-from cosl import JujuTopology
+from cosl import JujuTopology, LZMABase64
 from ops.model import ModelError
 from ops.framework import (
     BoundEvent,
@@ -234,7 +252,7 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 3
+LIBPATCH = 15
 
 PYDEPS = ["pydantic"]
 
@@ -242,6 +260,26 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_RELATION_NAME = "probes"
 
+# Wire formats of the probes in the provider's databag:
+# - "v0": `scrape_probes` holds the probes as JSON.
+# - "v1": `probes_format` is "v1", `scrape_probes_chunks` holds a number N of chunks and
+#   `scrape_probes_0` to `scrape_probes_<N-1>` hold, once concatenated, the LZMA-compressed
+#   and base64-encoded JSON of the probes.
+# Requirers list the formats they support in `supported_probes_formats`.
+PROBES_FORMATS = ["v0", "v1"]
+
+# Prefix of the files the requirer caches the probes and modules of each relation in
+PAYLOAD_FILE_PREFIX = "probes_payload-"
+
+# Keys of the requirer's stored state up to LIBPATCH 3, which held the probes and modules
+# themselves
+LEGACY_STORED_KEYS = (
+    "scrape_probes",
+    "blackbox_scrape_modules",
+    "probes_need_update",
+    "modules_need_update",
+)
+
 class DataValidationError(Exception):
     """Raised when data validation fails on IPU relation data."""
 
@@ -400,6 +438,8 @@ class BlackboxProbesProvider(Object):
         modules: Optional[Dict] = None,
         refresh_event: Optional[Union[BoundEvent, List[BoundEvent]]] = None,
         relation_name: str = DEFAULT_RELATION_NAME,
+        compression: bool = False,
+        chunk_size: int = 0,
     ):
         super().__init__(charm, relation_name)
         self._stored.set_default(
@@ -432,10 +472,17 @@ class BlackboxProbesProvider(Object):
             relation_name: name of the relation providing the Blackbox Probes
                 service. It's recommended to not change it, to ensure a
                 consistent experience across all charms that use the library.
+            compression: whether to send the probes compressed, to the requirers that
+                support it. Useful to keep large sets of probes within the relation data
+                size limits.
+            chunk_size: with `compression`, the maximum size of a single databag value
+                holding compressed probes. Zero (the default) means a single value.
         """
         self.topology = JujuTopology.from_charm(charm)
         self._charm = charm
         self._relation_name = relation_name
+        self._compression = compression
+        self._chunk_size = chunk_size
 
         self._probes = [] if probes is None else copy.deepcopy(probes)
         self._modules = {} if modules is None else copy.deepcopy(modules)
@@ -475,13 +522,18 @@ class BlackboxProbesProvider(Object):
             return
 
         errors = []
+        rendered: Dict[bool, Dict[str, str]] = {}
         for relation in self._charm.model.relations[self._relation_name]:
             try:
-                databag = ApplicationDataModel(
-                    scrape_metadata=self._scrape_metadata,
-                    scrape_probes=self._probes,
-                    scrape_modules=self._modules,
-                ).dump(relation.data[self._charm.app])
+                compressed = self._compression and "v1" in self._requirer_formats(relation)
+                if compressed not in rendered:
+                    model = ApplicationDataModel(
+                        scrape_metadata=self._scrape_metadata,
+                        scrape_probes=self._probes,
+                        scrape_modules=self._modules,
+                    )
+                    rendered[compressed] = self._render_v1(model) if compressed else model.dump()
+                self._update_databag(relation.data[self._charm.app], rendered[compressed])
             except ModelError as e:
                 # args are bytes
                 msg = e.args[0]
@@ -501,6 +553,41 @@ class BlackboxProbesProvider(Object):
 
         self._stored.errors = errors
 
+    @staticmethod
+    def _requirer_formats(relation) -> List[str]:
+        """The probes wire formats the requirer of a relation supports."""
+        if not relation.app:
+            return ["v0"]
+        try:
+            return json.loads(relation.data[relation.app].get("supported_probes_formats", "[]"))
+        except json.JSONDecodeError:
+            return ["v0"]
+
+    def _render_v1(self, model: "ApplicationDataModel") -> Dict[str, str]:
+        """Render the databag contents with the probes compressed, and chunked, as in "v1"."""
+        content = model.dump()
+        compressed = LZMABase64.compress(content.pop("scrape_probes"))
+        size = self._chunk_size or len(compressed)
+        chunks = [compressed[i : i + size] for i in range(0, len(compressed), size)]
+        content["probes_format"] = "v1"
+        content["scrape_probes_chunks"] = str(len(chunks))
+        for index, chunk in enumerate(chunks):
+            content[f"scrape_probes_{index}"] = chunk
+        return content
+
+    @staticmethod
+    def _update_databag(databag: MutableMapping, content: Dict[str, str]):
+        """Make a databag hold `content`, writing only the keys that differ.
+
+        Every write makes Juju emit relation-changed on the requirer side, which then
+        reconciles its configuration, so unchanged contents are not written again.
+        """
+        for key in [key for key in databag.keys() if key not in content]:
+            del databag[key]
+        for key, value in content.items():
+            if databag.get(key) != value:
+                databag[key] = value
+
     def _prefix_probes(self, prefix: str) -> None:
         """Prefix the probes job_names and the probe_modules with the charm metadata.
 
@@ -564,6 +651,27 @@ class MonitoringEvents(ObjectEvents):
 
     targets_changed = EventSource(TargetsChangedEvent)
 
+def _canonical_json(data) -> str:
+    """Serialize data to JSON deterministically."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":"))
+
+
+def _normalize_probe(probe: Dict) -> Dict:
+    """Return a form of a probe that is identical for semantically identical probes.
+
+    Unset fields are dropped, and the targets and static configs are sorted, so that neither
+    their order nor new optional fields in the provider's data change the probe digest.
+    """
+    normalized = {key: value for key, value in probe.items() if value is not None}
+    static_configs = []
+    for static_config in probe.get("static_configs") or []:
+        static_config = {key: value for key, value in static_config.items() if value is not None}
+        static_config["targets"] = sorted(set(static_config.get("targets", [])))
+        static_configs.append(static_config)
+    normalized["static_configs"] = sorted(static_configs, key=_canonical_json)
+    return normalized
+
+
 def _type_convert_stored(obj):
     """Convert Stored* to their appropriate types, recursively."""
     if isinstance(obj, StoredList):
@@ -582,7 +690,12 @@ class BlackboxProbesRequirer(Object):
     on = MonitoringEvents()  # pyright: ignore
     _stored = StoredState()
 
-    def __init__(self, charm: CharmBase, relation_name: str = DEFAULT_RELATION_NAME):
+    def __init__(
+        self,
+        charm: CharmBase,
+        relation_name: str = DEFAULT_RELATION_NAME,
+        cache_dir: Optional[Union[str, Path]] = None,
+    ):
         """"A requirer object for Blackbox Exporter probes.
 
         Args:
@@ -590,23 +703,45 @@ class BlackboxProbesRequirer(Object):
                 instance of the Blackbox Exporter service.
             relation_name: an optional string name of the relation between `charm`
                 and the Blackbox Exporter charmed service. The default is "probes".
+            cache_dir: an optional directory where the probes and modules of each
+                relation are cached across hooks. Defaults to a directory under the
+                system's temporary directory.
         """
 
         super().__init__(charm, relation_name)
+        self._drop_legacy_stored_keys()
         self._stored.set_default(
-            scrape_probes=[],
-            blackbox_scrape_modules={},
+            relation_cache={},
+            relations_need_update=[],
             errors=[],
-            probes_need_update=True,
-            modules_need_update=True,
         )
         self._charm = charm
         self._relation_name = relation_name
+        self._cache_dir = Path(
+            cache_dir or Path(tempfile.gettempdir(), f"{charm.app.name}-{relation_name}")
+        )
+        # Payloads already read from (or written to) the cache directory in this dispatch
+        self._payloads: Dict[str, Any] = {}
         events = self._charm.on[relation_name]
+        self.framework.observe(events.relation_joined, self._advertise_formats)
+        self.framework.observe(self._charm.on.leader_elected, self._advertise_formats)
+        # Relations that existed before the upgrade are not joined again
+        self.framework.observe(self._charm.on.upgrade_charm, self._advertise_formats)
         self.framework.observe(events.relation_changed, self._on_probes_provider_relation_changed)
         self.framework.observe(
             events.relation_departed, self._on_probes_provider_relation_departed
         )
+        self.framework.observe(events.relation_broken, self._on_probes_provider_relation_broken)
+
+    def _drop_legacy_stored_keys(self):
+        """Forget the probes and modules that older versions of this library stored."""
+        data = self._stored._data  # pyright: ignore
+        snapshot = data.snapshot()
+        if any(key in snapshot for key in LEGACY_STORED_KEYS):
+            data.restore(
+                {key: value for key, value in snapshot.items() if key not in LEGACY_STORED_KEYS}
+            )
+            data.dirty = True
 
     def _on_probes_provider_relation_changed(self, event):
         """Handle changes with related probes providers.
@@ -620,11 +755,21 @@ class BlackboxProbesRequirer(Object):
             event: a `CharmEvent` in response to which the Blackbox Exporter
                 charm must update its scrape configuration.
         """
+        self._advertise_formats()
         rel_id = event.relation.id
-        self._stored.probes_need_update = True
-        self._stored.modules_need_update = True
+        self._mark_relation_for_update(rel_id)
         self.on.targets_changed.emit(relation_id=rel_id)
 
+    def _advertise_formats(self, _=None):
+        """Let the probes providers know which wire formats this requirer supports."""
+        if not self._charm.unit.is_leader():
+            return
+        formats = json.dumps(PROBES_FORMATS)
+        for relation in self._charm.model.relations[self._relation_name]:
+            databag = relation.data[self._charm.app]
+            if databag.get("supported_probes_formats") != formats:
+                databag["supported_probes_formats"] = formats
+
     def _on_probes_provider_relation_departed(self, event):
         """Update job config when a probes provider departs.
 
@@ -638,10 +783,25 @@ class BlackboxProbesRequirer(Object):
                unit has departed.
         """
         rel_id = event.relation.id
-        self._stored.probes_need_update = True
-        self._stored.modules_need_update = True
+        self._mark_relation_for_update(rel_id)
         self.on.targets_changed.emit(relation_id=rel_id)
 
+    def _on_probes_provider_relation_broken(self, event):
+        """Drop the probes and modules of a removed probes provider.
+
+        Args:
+            event: a `CharmEvent` that indicates a probes provider relation is gone.
+        """
+        rel_id = event.relation.id
+        self._stored.relation_cache.pop(str(rel_id), None)
+        self._remove_stale_payloads(self._cached_payloads())
+        self.on.targets_changed.emit(relation_id=rel_id)
+
+    def _mark_relation_for_update(self, relation_id: int):
+        """Flag the cached probes and modules of a relation as stale."""
+        if str(relation_id) not in self._stored.relations_need_update:
+            self._stored.relations_need_update.append(str(relation_id))
+
     def get_status(self) -> StatusBase:
         """Collect the status of probes and errors from stored state.
 
@@ -655,7 +815,7 @@ class BlackboxProbesRequirer(Object):
         if self._stored.errors:
             error_messages = "; ".join(self._stored.errors)
             return BlockedStatus(f"Errors occurred in probe configuration: {error_messages}")
-        if self._stored.needs_update:
+        if self._stored.relations_need_update:
             return WaitingStatus("Probes are being updated, please wait.")
         return ActiveStatus()
 
@@ -666,7 +826,7 @@ class BlackboxProbesRequirer(Object):
         for probe in databag.scrape_probes:
             probe_data = probe.model_dump()
 
-            probe_str = str(probe_data)
+            probe_str = _canonical_json(_normalize_probe(probe_data))
             probe_hash = hashlib.sha256(probe_str.encode()).hexdigest()
 
             job_name = probe_data.get("job_name", "")
@@ -678,69 +838,243 @@ class BlackboxProbesRequirer(Object):
 
         return scrape_probes_hashed
 
-    def _update_probes(self):
-        """Update the cache of probes and errors by iterating over relation data."""
-        scrape_probes = []
-        errors = []
+    @staticmethod
+    def _raw_probes(databag: MutableMapping) -> str:
+        """The probes of a databag as sent by the provider, i.e. possibly compressed."""
+        if databag.get("probes_format") != "v1":
+            return databag.get("scrape_probes", "")
+        try:
+            chunks = int(databag.get("scrape_probes_chunks", "0"))
+        except ValueError as e:
+            raise DataValidationError(f"invalid scrape_probes_chunks: {e}") from e
+        return "".join(databag.get(f"scrape_probes_{index}", "") for index in range(chunks))
 
-        for relation in self._charm.model.relations[self._relation_name]:
-            try:
-                if not relation.data[relation.app]:
-                    continue
-                databag = ApplicationDataModel.load(relation.data[relation.app])
-                relation_scrape_probes = self._process_and_hash_probes(databag)
-                scrape_probes.extend(relation_scrape_probes)
-            except (json.JSONDecodeError, pydantic.ValidationError, DataValidationError) as e:
-                error_message = f"Invalid probes provided in relation {relation.id}: {e}"
-                errors.append(error_message)
+    @classmethod
+    def _decode_databag(cls, databag: MutableMapping) -> MutableMapping:
+        """Return a databag with its probes in the "v0" format, decompressing them if needed."""
+        if databag.get("probes_format") != "v1":
+            return databag
+        decoded = {
+            key: value for key, value in databag.items() if not key.startswith("scrape_probes_")
+        }
+        try:
+            decoded["scrape_probes"] = LZMABase64.decompress(cls._raw_probes(databag))
+        except (binascii.Error, lzma.LZMAError, UnicodeDecodeError) as e:
+            raise DataValidationError(f"invalid compressed scrape_probes: {e}") from e
+        return decoded
+
+    @staticmethod
+    def _databag_digest(databag: MutableMapping) -> str:
+        """Digest of the raw contents of a relation databag."""
+        raw = json.dumps(
+            {key: databag[key] for key in sorted(databag.keys())}, separators=(",", ":")
+        )
+        return hashlib.sha256(raw.encode()).hexdigest()
 
-        self._stored.scrape_probes = scrape_probes
-        self._stored.errors = errors
-        self._stored.probes_need_update = False
+    def _payload_path(self, digest: str) -> Path:
+        """Path of the file caching the payload of a digest."""
+        return self._cache_dir / f"{PAYLOAD_FILE_PREFIX}{digest}.json"
 
-        return scrape_probes
+    def _read_payload(self, digest: str) -> Optional[Any]:
+        """Read the probes or modules cached under a digest; None if they are not."""
+        if digest not in self._payloads:
+            try:
+                path = self._payload_path(digest)
+                self._payloads[digest] = json.loads(path.read_text())
+            except (OSError, ValueError):
+                return None
+        return self._payloads[digest]
 
-    def probes(self) -> list:
-        """Fetch the list of probes to scrape, if they need update
+    def _write_payload(self, payload: Union[List, Dict]) -> str:
+        """Cache probes or modules on disk, under the digest of their contents.
 
         Returns:
-            A list consisting of all the static probes configurations
-            for each related `BlackboxExporterProvider'.
+            The digest of the payload.
         """
+        serialized = _canonical_json(payload)
+        digest = hashlib.sha256(serialized.encode()).hexdigest()
+        self._payloads[digest] = payload
+        path = self._payload_path(digest)
+        if not path.exists():
+            try:
+                self._cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_text(serialized)
+                tmp_path.replace(path)
+            except OSError as e:
+                # The relation will simply be parsed again in the next hook
+                logger.debug("Cannot cache the probes on disk: %s", e)
+        return digest
+
+    def _cached_payloads(self) -> List[str]:
+        """Digests of all the payloads the cache entries refer to."""
+        return [
+            entry.get(key, "")
+            for entry in self._stored.relation_cache.values()
+            for key in ("probes_payload", "modules_payload")
+        ]
 
-        if self._stored.probes_need_update:
-            self._update_probes()
+    def _remove_stale_payloads(self, digests: List[str]):
+        """Remove the cached payloads that are not any of `digests`.
 
-        probes = [] + _type_convert_stored(
-            self._stored.scrape_probes  # pyright: ignore
-        )
-        return probes
+        Only the files written by this library are considered: the cache directory may be
+        shared with other files.
+        """
+        for path in self._cache_dir.glob(f"{PAYLOAD_FILE_PREFIX}*.json"):
+            if path.stem[len(PAYLOAD_FILE_PREFIX) :] not in digests:
+                path.unlink(missing_ok=True)
 
-    def _update_modules(self) -> dict:
-        """Fetch the dict of blackbox modules to configure.
+    def _load_relation(self, relation, cached: Optional[Dict] = None) -> Dict:
+        """Parse the probes and modules of a relation, unless its databag is unchanged.
+
+        Args:
+            relation: the probes relation to load.
+            cached: the cache entry previously computed for this relation, if any.
 
         Returns:
-            A dict consisting of all the modueles configurations
-            for each related `BlackboxExporterProvider`.
+            A cache entry with the databag `digest`, the digest of its raw probes
+            (`probes_digest`), the digests of the hashed probes (`probes_payload`) and of the
+            modules (`modules_payload`) it holds, and an `error` message.
         """
-        blackbox_scrape_modules = {}
-        errors = []
-
-        for relation in self._charm.model.relations[self._relation_name]:
+        databag = relation.data[relation.app]
+        digest = self._databag_digest(databag)
+        cached_probes = None
+        if cached is not None and cached.get("modules_payload"):
+            cached_probes = self._read_payload(cached["probes_payload"])
+        if (
+            cached is not None
+            and cached_probes is not None
+            and cached["digest"] == digest
+            and self._read_payload(cached["modules_payload"]) is not None
+        ):
+            return cached
+
+        entry = {
+            "digest": digest,
+            "probes_digest": "",
+            "probes_payload": "",
+            "modules_payload": "",
+            "error": "",
+        }
+        probes, modules = [], {}
+        if databag:
             try:
-                if not relation.data[relation.app]:
-                    continue
-                databag = ApplicationDataModel.load(relation.data[relation.app])
-                blackbox_scrape_modules = databag.dict(exclude_unset=True)["scrape_modules"]
+                # The probes are hashed again only if the provider changed them, not e.g. its
+                # modules
+                probes_digest = hashlib.sha256(self._raw_probes(databag).encode()).hexdigest()
+                entry["probes_digest"] = probes_digest
+                model = ApplicationDataModel.load(self._decode_databag(databag))
+                if (
+                    cached is not None
+                    and cached_probes is not None
+                    and not cached["error"]
+                    and cached.get("probes_digest") == probes_digest
+                ):
+                    probes = cached_probes
+                else:
+                    probes = self._process_and_hash_probes(model)
+                modules = model.model_dump(exclude_unset=True)["scrape_modules"] or {}
             except (json.JSONDecodeError, pydantic.ValidationError, DataValidationError) as e:
-                error_message = f"Invalid blackbox module provided in relation {relation.id}: {e}"
-                errors.append(error_message)
+                # The details may embed the whole databag: keep them out of the stored state
+                logger.debug("Invalid probes provided in relation %s: %s", relation.id, e)
+                entry["error"] = f"Invalid probes provided in relation {relation.id}"
+        entry["probes_payload"] = self._write_payload(probes)
+        entry["modules_payload"] = self._write_payload(modules)
+        return entry
+
+    def _update_cache(self, with_probes: bool = True) -> Tuple[List[dict], Dict[str, dict]]:
+        """Update the per-relation cache and aggregate the probes and modules of all relations.
+
+        Only the relations that changed since they were last parsed, or that are not cached
+        yet, are read and validated again. Relations that are gone are dropped from the cache.
+        Modules are merged across relations; when two relations define the same module
+        differently, the one from the relation that was listed first is kept and the
+        conflict is reported as an error. Errors are summarized in short messages, logged
+        once when they change.
+
+        The stored state only keeps digests: the probes and modules themselves are kept in
+        separate files named after their digest, so that the size of the state committed at
+        the end of every hook does not grow with the number of probes, and the modules can be
+        read without the probes.
 
-        self._stored.blackbox_scrape_modules = blackbox_scrape_modules
-        self._stored.errors = errors
-        self._stored.modules_need_update = False
+        Args:
+            with_probes: whether to aggregate the probes too, or only the modules.
+
+        Returns:
+            A tuple with the list of probes (empty unless `with_probes`) and the dict of
+            modules of all relations.
+        """
+        cache = self._stored.relation_cache
+        relations = self._charm.model.relations[self._relation_name]
+
+        current_ids = {str(relation.id) for relation in relations}
+        changed = False
+        for rel_id in [rel_id for rel_id in cache.keys() if rel_id not in current_ids]:
+            del cache[rel_id]
+            changed = True
+
+        need_update = set(self._stored.relations_need_update)
+        scrape_probes = []
+        modules = {}
+        module_owners = {}
+        invalid_relations = []
+        conflicting_modules = []
+        for relation in relations:
+            rel_id = str(relation.id)
+            entry = _type_convert_stored(cache[rel_id]) if rel_id in cache else None
+            relation_probes = relation_modules = None
+            if entry is not None and rel_id not in need_update:
+                # Entries of older versions of this library have no modules payload digest
+                relation_modules = self._read_payload(entry.get("modules_payload", ""))
+                if with_probes:
+                    relation_probes = self._read_payload(entry["probes_payload"])
+            if relation_modules is None or (with_probes and relation_probes is None):
+                cached = entry
+                entry = self._load_relation(relation, cached)
+                if entry != cached:
+                    cache[rel_id] = entry
+                    changed = True
+                relation_modules = self._read_payload(entry["modules_payload"])
+                relation_probes = self._read_payload(entry["probes_payload"])
+            if with_probes:
+                scrape_probes.extend(copy.deepcopy(relation_probes))
+            if entry["error"]:  # pyright: ignore
+                invalid_relations.append(rel_id)
+
+            for name, module in relation_modules.items():  # pyright: ignore
+                owner = module_owners.setdefault(name, relation.id)
+                if owner == relation.id:
+                    modules[name] = copy.deepcopy(module)
+                elif modules[name] != module and name not in conflicting_modules:
+                    conflicting_modules.append(name)
+
+        if changed:
+            self._remove_stale_payloads(self._cached_payloads())
+        self._stored.relations_need_update = []
+        errors = []
+        if invalid_relations:
+            errors.append(f"Invalid probes in relation(s) {', '.join(invalid_relations)}")
+        if conflicting_modules:
+            errors.append(f"Conflicting blackbox module(s) {', '.join(conflicting_modules)}")
+        # Only log the errors when they show up, not every time the probes are read
+        known_errors = set(self._stored.errors)
+        for error in errors:
+            if error not in known_errors:
+                logger.warning(error)
+        if errors != list(self._stored.errors):
+            self._stored.errors = errors
+
+        return scrape_probes, modules
+
+    def probes(self) -> list:
+        """Fetch the list of probes to scrape, if they need update
 
-        return blackbox_scrape_modules
+        Returns:
+            A list consisting of all the static probes configurations
+            for each related `BlackboxExporterProvider'.
+        """
+        probes, _ = self._update_cache()
+        return probes
 
     def modules(self) -> dict:
         """Fetch the dict of blackbox modules to configure.
@@ -749,11 +1083,5 @@ class BlackboxProbesRequirer(Object):
             A dict consisting of all the modueles configurations
             for each related `BlackboxExporterProvider`.
         """
-
-        if self._stored.modules_need_update:
-            self._update_modules()
-
-        modules = {}
-        modules.update(_type_convert_stored(self._stored.blackbox_scrape_modules))
-
+        _, modules = self._update_cache(with_probes=False)
         return modules
@@ -4,21 +4,29 @@
 
 """Workload manager for Blackbox Exporter."""
 
+import hashlib
 import logging
+import math
 import re
 import time
 import urllib.error
 import urllib.parse
 import urllib.request
-from typing import Dict, Optional, cast
+from decimal import Decimal
+from typing import Callable, Dict, Optional, cast
 
-import yaml
-from ops.framework import Object
+from lightkube.models.core_v1 import ResourceRequirements
+from lightkube.utils.quantity import parse_quantity
+from ops.framework import Object, StoredState
 from ops.pebble import (  # type: ignore
+    APIError,
     ChangeError,
     Layer,
+    PathError,
 )
 
+import yaml_codec
+
 logger = logging.getLogger(__name__)
 
 
@@ -37,8 +45,13 @@ class ContainerNotReady(WorkloadManagerError):
 class WorkloadManager(Object):
     """Workload manager for blackbox exporter."""
 
+    _stored = StoredState()
+
     _layer_name = _service_name = "blackbox"
     _exe_name = "blackbox_exporter"
+    _exe_path = f"/bin/{_exe_name}"
+    # Share of the memory limit the Go runtime may use, the rest being headroom
+    _gomemlimit_ratio = Decimal("0.9")
     _default_config = {
         "modules": {
             "http_2xx": {"prober": "http", "http": {"preferred_ip_protocol": "ip4"}},
@@ -88,9 +101,11 @@ class WorkloadManager(Object):
         web_external_url: str,
         config_path: str,
         log_path: str,
+        resource_reqs_func: Optional[Callable[[], ResourceRequirements]] = None,
     ):
         # Must inherit from ops 'Object' to be able to register events.
         super().__init__(charm, f"{self.__class__.__name__}-{container_name}")
+        self._stored.set_default(config_digest="", version_key="", version="")
 
         self._unit = charm.unit
 
@@ -99,10 +114,14 @@ class WorkloadManager(Object):
 
         self.api = BlackboxExporterApi(endpoint_url=charm._external_url)
 
+        # Size, in bytes, of the last config rendered by `push_config`
+        self.config_size = 0
+
         self._port = port
         self._web_external_url = web_external_url
         self._config_path = config_path
         self._log_path = log_path
+        self._resource_reqs_func = resource_reqs_func
 
         # turn the container name to a valid Python identifier
         snake_case_container_name = self._container_name.replace("-", "_")
@@ -116,6 +135,9 @@ class WorkloadManager(Object):
         return self._container.can_connect()
 
     def _on_pebble_ready(self, _):
+        # A (re)started container no longer holds the config we last pushed
+        self._stored.config_digest = ""
+
         if version := self._blackbox_exporter_version:
             self._unit.set_workload_version(version)
         else:
@@ -132,13 +154,58 @@ class WorkloadManager(Object):
         """
         if not self.is_ready:
             return None
+
+        # Exec-ing into the container is slow, so only do it when the workload image changed
+        key = self._executable_fingerprint()
+        if key and key == self._stored.version_key:
+            return cast(str, self._stored.version) or None
+
         version_output, _ = self._container.exec([self._exe_name, "--version"]).wait_output()
         # Output looks like this:
         # blackbox_exporter, version 0.24.0 (branch: HEAD, ...)
         result = re.search(r"version (\d*\.\d*\.\d*)", version_output)
-        if result is None:
-            return result
-        return result.group(1)
+        version = result.group(1) if result else None
+        if key:
+            self._stored.version_key = key
+            self._stored.version = version or ""
+        return version
+
+    def _executable_fingerprint(self) -> Optional[str]:
+        """Return an identifier of the blackbox exporter binary shipped by the workload image.
+
+        The size and modification time of the binary change whenever the OCI image does, and
+        fetching them is a single cheap Pebble call.
+        """
+        try:
+            info = self._container.list_files(self._exe_path, itself=True)[0]
+        except (APIError, PathError, IndexError):
+            return None
+        return f"{info.size}:{info.last_modified.isoformat()}"
+
+    def _go_runtime_environment(self) -> Dict[str, str]:
+        """Size the Go runtime after the container's resource limits.
+
+        Without these, the exporter schedules goroutines over all the node's cores and lets
+        its heap grow until the pod is OOM-killed. GOMEMLIMIT leaves some headroom below the
+        memory limit for the memory the Go runtime does not account for.
+        """
+        if not self._resource_reqs_func:
+            return {}
+        try:
+            limits = self._resource_reqs_func().limits or {}
+            cpu = parse_quantity(limits.get("cpu"))
+            memory = parse_quantity(limits.get("memory"))
+        except ValueError as e:
+            logger.debug("Not sizing the Go runtime: %s", e)
+            return {}
+
+        environment = {}
+        if cpu:
+            environment["GOMAXPROCS"] = str(max(1, math.floor(cpu)))
+        if memory:
+            mebibytes = math.floor(memory * self._gomemlimit_ratio / 2**20)
+            environment["GOMEMLIMIT"] = f"{max(1, mebibytes)}MiB"
+        return environment
 
     def _blackbox_exporter_layer(self) -> Layer:
         """Returns Pebble configuration layer for Blackbox Exporter."""
@@ -163,17 +230,33 @@ class WorkloadManager(Object):
                         "summary": "blackbox exporter service",
                         "command": _command(),
                         "startup": "enabled",
+                        "environment": self._go_runtime_environment(),
                     }
                 },
             }
         )
 
-    def update_layer(self) -> None:
-        """Update service layer."""
+    @property
+    def layer(self) -> Layer:
+        """The Pebble layer the blackbox exporter service should run with."""
+        return self._blackbox_exporter_layer()
+
+    def update_layer(self) -> bool:
+        """Update service layer.
+
+        Returns:
+            True if the layer was (re)applied and the service replanned; False if the service
+            was already running with the desired definition.
+        """
         if not self.is_ready:
             raise ContainerNotReady("cannot update layer")
 
         overlay = self._blackbox_exporter_layer()
+        current = self._container.get_plan().services.get(self._service_name)
+        if current == overlay.services[self._service_name]:
+            service = self._container.get_services(self._service_name).get(self._service_name)
+            if service and service.is_running():
+                return False
 
         self._container.add_layer(self._layer_name, overlay, combine=True)
         try:
@@ -185,6 +268,7 @@ class WorkloadManager(Object):
                 self._container.get_plan().to_dict(),
                 str(e),
             )
+        return True
 
     def build_config(self) -> Dict:
         """Update blackbox exporter config file to reflect changes in configuration.
@@ -201,19 +285,43 @@ class WorkloadManager(Object):
             return self._default_config
         # If a config file is specified, do basic config validation: valid yaml
         try:
-            provided_config = yaml.safe_load(config)
-        except yaml.YAMLError as e:
+            provided_config = yaml_codec.safe_load(config)
+        except yaml_codec.YAMLError as e:
             logger.error("Failed to load the configuration; invalid YAML: %s %s", config, str(e))
             raise ConfigUpdateFailure("Failed to load config; invalid YAML")
         return provided_config
 
-    def push_config(self, config: Dict) -> None:
-        """Push a blackbox config if it's different than the one on disk."""
+    def _current_config_digest(self) -> str:
+        """Return the SHA-256 of the config file in the container.
+
+        The digest remembered from the last push is used when known; otherwise the raw file is
+        pulled and hashed (without parsing it). An empty string means there is no config file.
+        """
+        if self._stored.config_digest:
+            return cast(str, self._stored.config_digest)
+        try:
+            current = self._container.pull(self._config_path, encoding=None).read()
+        except PathError:
+            return ""
+        self._stored.config_digest = hashlib.sha256(current).hexdigest()
+        return cast(str, self._stored.config_digest)
+
+    def push_config(self, config: Dict) -> bool:
+        """Push a blackbox config if it's different than the one on disk.
+
+        Returns:
+            True if the config file was written; False if it was already up to date.
+        """
         if not self.is_ready:
             raise ContainerNotReady("cannot update config")
-        current_config = yaml.safe_load(self._container.pull(self._config_path).read())
-        if config != current_config:
-            self._container.push(self._config_path, yaml.dump(config), make_dirs=True)
+        rendered = yaml_codec.safe_dump(config).encode()
+        self.config_size = len(rendered)
+        digest = hashlib.sha256(rendered).hexdigest()
+        if digest == self._current_config_digest():
+            return False
+        self._container.push(self._config_path, rendered, make_dirs=True)
+        self._stored.config_digest = digest
+        return True
 
     def restart_service(self) -> bool:
         """Helper function for restarting the underlying service.
@@ -4,9 +4,13 @@
 
 """A Juju charm for Blackbox Exporter."""
 
+import hashlib
+import json
 import logging
 import socket
-from typing import Dict, cast
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, cast
 from urllib.parse import urlparse
 
 import ops_tracing
@@ -23,25 +27,53 @@ from charms.observability_libs.v0.kubernetes_compute_resources_patch import (
 )
 from charms.prometheus_k8s.v0.prometheus_scrape import MetricsEndpointProvider
 from charms.traefik_k8s.v2.ingress import IngressPerAppRequirer
+from lightkube import ApiError
 from ops.charm import ActionEvent, CharmBase
+from ops.framework import BoundEvent, StoredState
 from ops.main import main
 from ops.model import (
     ActiveStatus,
     BlockedStatus,
     MaintenanceStatus,
+    StatusBase,
     WaitingStatus,
 )
 from ops.pebble import PathError, ProtocolError
 
-from blackbox import ConfigUpdateFailure, WorkloadManager
-from scrape_config_builder import ScrapeConfigBuilder
+from blackbox import ConfigUpdateFailure, ContainerNotReady, WorkloadManager
+from resource_sizing import (
+    apply_hysteresis,
+    estimate_resource_requests,
+    limits_from_requests,
+)
+from scrape_config_builder import ScrapeConfigBuilder, parse_scrape_tiers
+from stage_timer import StageTimer
 
 logger = logging.getLogger(__name__)
 
 
+def _pod_incarnation() -> str:
+    """Identify the current incarnation of this pod, or "" if that is not possible.
+
+    The pod UID is not available without a K8s API call, but a new pod, even one with the
+    same name, comes with a new charm container whose PID 1 started at a different time, or on
+    a host that booted at a different time.
+    """
+    try:
+        boot_id = Path("/proc/sys/kernel/random/boot_id").read_text().strip()
+        # The start time is the 22nd field, counting from the end of the parenthesized name
+        stat = Path("/proc/1/stat").read_text()
+        start_time = stat.rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ""
+    return f"{socket.gethostname()}:{boot_id}:{start_time}"
+
+
 class BlackboxExporterCharm(CharmBase):
     """A Juju charm for Blackbox Exporter."""
 
+    _stored = StoredState()
+
     # Container name must match metadata.yaml
     # Service name matches charm name for consistency
     _container_name = _service_name = "blackbox"
@@ -51,8 +83,23 @@ class BlackboxExporterCharm(CharmBase):
     _config_path = "/etc/blackbox_exporter/config.yml"
     _log_path = "/var/blackbox.log"
 
+    # path, inside the charm container, to the caches kept across hooks
+    _cache_dir = Path(tempfile.gettempdir(), "blackbox-exporter-k8s")
+
+    _probe_sharding_modes = ("none", "partition", "hashmod")
+    _resource_sizing_modes = ("static", "requests", "requests-and-limits")
+
     def __init__(self, *args):
         super().__init__(*args)
+        self._stored.set_default(reconcile_fingerprint="", resources_ready_key="")
+        self._stage_timer = StageTimer()
+
+        # Inputs derived from the config and the probes relations, computed at most once per
+        # dispatch; see `_reset_memos`.
+        self._modules_memo: Optional[Dict] = None
+        self._probes_memo: Optional[List[Dict]] = None
+        self._scrape_jobs_memo: Optional[List[Dict]] = None
+        self._sized_requests_memo: Optional[Dict[str, str]] = None
 
         self.container = self.unit.get_container(self._container_name)
         self.unit.set_ports(self._port)
@@ -72,6 +119,7 @@ class BlackboxExporterCharm(CharmBase):
             web_external_url="",
             config_path=self._config_path,
             log_path=self._log_path,
+            resource_reqs_func=self._resource_reqs_from_config,
         )
         self.framework.observe(self.on.config_changed, self._on_config_changed)
 
@@ -85,6 +133,11 @@ class BlackboxExporterCharm(CharmBase):
         self.framework.observe(self.on.update_status, self._on_update_status)
         self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
 
+        # Changes made while handling any of the events in this dispatch (deferred ones
+        # included) are applied with a single reload, right before the framework commits.
+        self._reload_requested = False
+        self.framework.observe(self.framework.on.pre_commit, self._on_pre_commit)
+
         # Action events
         self.framework.observe(
             self.on.show_config_action,
@@ -92,35 +145,43 @@ class BlackboxExporterCharm(CharmBase):
         )
 
         # Libraries
+        self._probes_requirer = BlackboxProbesRequirer(
+            charm=self,
+            relation_name="probes",
+            cache_dir=self._cache_dir / "probes",
+        )
+
+        self.framework.observe(
+            self._probes_requirer.on.targets_changed, self._on_probes_modules_config_changed
+        )
+        # The sharded jobs, and the sized resource requests, depend on the number of units
+        self.framework.observe(self.on.replicas_relation_joined, self._on_replicas_changed)
+        self.framework.observe(self.on.replicas_relation_departed, self._on_replicas_changed)
+
         # - Kubernetes resource patch
         self.resources_patch = KubernetesComputeResourcesPatch(
             self,
             self._container_name,
             resource_reqs_func=self._resource_reqs_from_config,
+            refresh_event=self._resources_refresh_events(),
         )
         self.framework.observe(
             self.resources_patch.on.patch_failed,  # pyright: ignore
             self._on_k8s_patch_failed,
         )
 
-        self._probes_requirer = BlackboxProbesRequirer(
-            charm=self,
-            relation_name="probes",
-        )
-
-        self.framework.observe(
-            self._probes_requirer.on.targets_changed, self._on_probes_modules_config_changed
-        )
-
         # - Self monitoring and probes
+        # The scrape jobs are only computed when they are published
         self._scraping = MetricsEndpointProvider(
             self,
             relation_name="self-metrics-endpoint",
-            jobs=self.self_scraping_job + self.probes_scraping_jobs,
+            lookaside_jobs_callable=self._scrape_jobs,
             refresh_event=[
                 self.on.config_changed,
                 self.on.update_status,
                 self._probes_requirer.on.targets_changed,
+                self.on.replicas_relation_joined,
+                self.on.replicas_relation_departed,
             ],
         )
         self._grafana_dashboard_provider = GrafanaDashboardProvider(charm=self)
@@ -159,6 +220,20 @@ class BlackboxExporterCharm(CharmBase):
             ca_relation_name="receive-ca-cert",
         )
 
+    def _resources_refresh_events(self) -> List[BoundEvent]:
+        """The events after which the resources patch is applied again, besides config-changed.
+
+        With resource_sizing, the requests follow the probes and the number of units; otherwise
+        they only depend on the config.
+        """
+        if self.model.config.get("resource_sizing") in (None, "static"):
+            return []
+        return [
+            self._probes_requirer.on.targets_changed,
+            self.on.replicas_relation_joined,
+            self.on.replicas_relation_departed,
+        ]
+
     def _resource_reqs_from_config(self) -> ResourceRequirements:
         """Get the resources requirements from the Juju config."""
         limits = {
@@ -166,8 +241,77 @@ class BlackboxExporterCharm(CharmBase):
             "memory": self.model.config.get("memory"),
         }
         requests = {"cpu": "0.25", "memory": "200Mi"}
+        resource_sizing = self.model.config.get("resource_sizing")
+        if resource_sizing in ("requests", "requests-and-limits"):
+            requests = self._sized_requests()
+        if resource_sizing == "requests-and-limits":
+            # Explicit limits win over the estimated ones
+            limits = {
+                resource: limits[resource] or quantity
+                for resource, quantity in limits_from_requests(requests).items()
+            }
         return adjust_resource_requirements(limits, requests, adhere_to_requests=True)
 
+    def _sized_requests(self) -> Dict[str, str]:
+        """Resource requests estimated from the probes this unit serves, with hysteresis.
+
+        Computed at most once per dispatch. The estimate is damped against the requests
+        already in the StatefulSet, which all the units patch, so that they all agree on the
+        same requests whatever they remember locally.
+        """
+        if self._sized_requests_memo is None:
+            sharded = self.model.config.get("probe_sharding") in ("partition", "hashmod")
+            proposed = estimate_resource_requests(
+                self._probes(),
+                self._rendered_modules(),
+                shards=self.app.planned_units() if sharded else 1,
+            )
+            self._sized_requests_memo = apply_hysteresis(self._applied_requests(), proposed)
+        return self._sized_requests_memo
+
+    def _applied_requests(self) -> Dict[str, str]:
+        """The resource requests of the StatefulSet template, or none if unknown."""
+        try:
+            applied = self.resources_patch.patcher.get_templated()
+        except (ApiError, ValueError) as e:
+            logger.debug("Cannot get the applied resource requests: %s", e)
+            return {}
+        requests = (applied.requests if applied else None) or {}
+        return {resource: str(quantity) for resource, quantity in requests.items()}
+
+    def _resources_patch_key(self) -> str:
+        """Identify the desired resource requirements of this pod, or "" if unknown."""
+        incarnation = _pod_incarnation()
+        if not incarnation:
+            return ""
+        try:
+            resource_reqs = self._resource_reqs_from_config()
+        except ValueError:
+            return ""
+        serialized = json.dumps(
+            {
+                "limits": resource_reqs.limits,
+                "requests": resource_reqs.requests,
+                "pod": incarnation,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def _resources_patch_ready(self) -> bool:
+        """Whether the resources patch is in effect, without asking K8s when already known.
+
+        Checking it takes several round-trips to the K8s API. Once the patch is in effect, it
+        stays so until either the desired resource requirements change or the pod is replaced,
+        so the answer is remembered for that pair.
+        """
+        key = self._resources_patch_key()
+        if key and key == self._stored.resources_ready_key:
+            return True
+        ready = self.resources_patch.is_ready()
+        self._stored.resources_ready_key = key if ready else ""
+        return ready
+
     def _on_k8s_patch_failed(self, event: K8sResourcePatchFailedEvent):
         self.unit.status = BlockedStatus(str(event.message))
 
@@ -194,14 +338,57 @@ class BlackboxExporterCharm(CharmBase):
         except (ProtocolError, PathError) as e:
             event.fail(str(e))
 
-    def _common_exit_hook(self) -> None:
-        """Event processing hook that is common to all events to ensure idempotency."""
-        if not self.resources_patch.is_ready():
+    def _reconcile_fingerprint(self, modules: Dict) -> str:
+        """Return a stable digest of every input that shapes the running workload.
+
+        Args:
+            modules: the blackbox modules coming from relation data.
+        """
+        inputs = {
+            "config": dict(self.model.config),
+            "modules": modules,
+            "external_url": self._external_url,
+            "layer": self.blackbox_workload.layer.to_dict(),
+        }
+        serialized = json.dumps(inputs, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def _config_error(self) -> Optional[str]:
+        """Validate the probes-related config options; return an error message if invalid."""
+        probe_sharding = self.model.config.get("probe_sharding")
+        if probe_sharding not in self._probe_sharding_modes:
+            return (
+                f"Invalid probe_sharding: '{probe_sharding}'; "
+                f"must be one of {', '.join(self._probe_sharding_modes)}."
+            )
+        try:
+            parse_scrape_tiers(cast(str, self.model.config.get("scrape_tiers")))
+        except ValueError as e:
+            return f"Invalid scrape_tiers: {e}"
+        resource_sizing = self.model.config.get("resource_sizing")
+        if resource_sizing not in self._resource_sizing_modes:
+            return (
+                f"Invalid resource_sizing: '{resource_sizing}'; "
+                f"must be one of {', '.join(self._resource_sizing_modes)}."
+            )
+        return None
+
+    def _common_exit_hook(self, force: bool = False) -> None:
+        """Event processing hook that is common to all events to ensure idempotency.
+
+        The workload is left untouched when none of its inputs changed since the last
+        successful reconcile, unless `force` is set (e.g. the container was (re)started).
+        """
+        with self._stage_timer.stage("resources_patch.is_ready"):
+            resources_ready = self._resources_patch_ready()
+        if not resources_ready:
             if isinstance(self.unit.status, ActiveStatus) or self.unit.status.message == "":
                 self.unit.status = WaitingStatus("Waiting for resource limit patch to apply")
             return
 
-        if not self.container.can_connect():
+        with self._stage_timer.stage("can_connect"):
+            can_connect = self.container.can_connect()
+        if not can_connect:
             self.unit.status = MaintenanceStatus("Waiting for pod startup to complete")
             return
 
@@ -219,26 +406,77 @@ class BlackboxExporterCharm(CharmBase):
                 )
                 return
 
+        if config_error := self._config_error():
+            self.unit.status = BlockedStatus(config_error)
+            return
+
+        with self._stage_timer.stage("fingerprint"):
+            modules = self._probes_requirer.modules()
+            fingerprint = self._reconcile_fingerprint(modules)
+        if not force and fingerprint == self._stored.reconcile_fingerprint:
+            logger.debug("Workload inputs unchanged; skipping reconcile.")
+            self.unit.status = self._probes_status()
+            return
+        # Only remember a fingerprint once the whole pipeline went through
+        self._stored.reconcile_fingerprint = ""
+
         # Update config file
         try:
-            base_config = self.blackbox_workload.build_config()
-            config = self._update_config_from_relation(
-                modules=self._probes_requirer.modules(),
-                config=base_config,
-            )
-            self.blackbox_workload.push_config(config)
+            with self._stage_timer.stage("build_config"):
+                base_config = self.blackbox_workload.build_config()
+            with self._stage_timer.stage("_update_config_from_relation"):
+                config = self._update_config_from_relation(
+                    modules=modules,
+                    config=base_config,
+                )
+            with self._stage_timer.stage("push_config") as span:
+                config_changed = self.blackbox_workload.push_config(config)
+                self._stage_timer.record_size(
+                    "push_config", self.blackbox_workload.config_size, span
+                )
 
         except ConfigUpdateFailure as e:
             self.unit.status = BlockedStatus(str(e))
             return
 
         # Update pebble layer
-        self.blackbox_workload.update_layer()
+        with self._stage_timer.stage("update_layer"):
+            layer_changed = self.blackbox_workload.update_layer()
+
+        # A replan restarts the service, which picks up the new config on its own
+        if config_changed and not layer_changed:
+            self._reload_requested = True
+
+        self._stored.reconcile_fingerprint = fingerprint
+        self.unit.status = self._probes_status()
+
+    def _probes_status(self) -> StatusBase:
+        """The unit status once reconciled: blocked if the probes relations are invalid.
+
+        Invalid probes and conflicting modules are left out of the config, without stopping
+        the workload from serving the rest of the probes.
+        """
+        status = self._probes_requirer.get_status()
+        return status if isinstance(status, BlockedStatus) else ActiveStatus()
 
-        # Reload or restart the service
-        self.blackbox_workload.reload()
+    def _on_pre_commit(self, _):
+        """Apply the pending reload, if any, and log how long the reconcile stages took."""
+        if self._reload_requested:
+            self._reload_requested = False
+            self._reload()
 
-        self.unit.status = ActiveStatus()
+        if self._stage_timer.durations:
+            logger.debug("Reconcile stages: %s", self._stage_timer.summary())
+
+    def _reload(self):
+        """Reload the service once for all the config changes pushed during this dispatch."""
+        try:
+            with self._stage_timer.stage("reload"):
+                self.blackbox_workload.reload()
+        except (ConfigUpdateFailure, ContainerNotReady) as e:
+            # Make sure the next hook goes through the whole pipeline again
+            self._stored.reconcile_fingerprint = ""
+            self.unit.status = BlockedStatus(str(e))
 
     @property
     def _internal_url(self) -> str:
@@ -253,6 +491,20 @@ class BlackboxExporterCharm(CharmBase):
         """
         return self.ingress.url or self._internal_url
 
+    @property
+    def _unit_addresses(self) -> List[str]:
+        """Return the in-cluster `host:port` addresses of all units, ordered by pod ordinal."""
+        # Pods of a StatefulSet are named <app>-<ordinal> and resolve under the same domain
+        fqdn = socket.getfqdn()
+        if "." in fqdn:
+            domain = fqdn.split(".", 1)[1]
+        else:
+            domain = f"{self.app.name}-endpoints.{self.model.name}.svc.cluster.local"
+        return [
+            f"{self.app.name}-{ordinal}.{domain}:{self._port}"
+            for ordinal in range(self.app.planned_units())
+        ]
+
     @property
     def self_scraping_job(self):
         """The self-monitoring scrape job."""
@@ -299,24 +551,83 @@ class BlackboxExporterCharm(CharmBase):
 
         return config
 
+    def _scrape_config_builder(self, modules: Optional[Dict] = None, **kwargs):
+        """A ScrapeConfigBuilder for the probes, with the scrape tiers of the config."""
+        try:
+            scrape_tiers = parse_scrape_tiers(cast(str, self.model.config.get("scrape_tiers")))
+        except ValueError:
+            # Reported as a blocked status by the reconcile
+            scrape_tiers = {}
+        if scrape_tiers and modules is None:
+            modules = self._rendered_modules()
+        return ScrapeConfigBuilder(
+            self._external_url,
+            sharding_mode=cast(str, self.model.config.get("probe_sharding")),
+            cache_dir=self._cache_dir,
+            scrape_tiers=scrape_tiers,
+            modules=modules,
+            deduplicate=cast(bool, self.model.config.get("deduplicate_probes")),
+            **kwargs,
+        )
+
+    def _rendered_modules(self) -> Dict:
+        """The blackbox modules of the config file, merged with the relation ones."""
+        if self._modules_memo is None:
+            try:
+                config = self.blackbox_workload.build_config()
+            except (ConfigUpdateFailure, ContainerNotReady):
+                config = {}
+            modules = config.get("modules") if isinstance(config, dict) else None
+            self._modules_memo = {**(modules or {}), **self._probes_requirer.modules()}
+        return self._modules_memo
+
+    def _probes(self) -> List[Dict]:
+        """The probes of the config and the relations, before they are sharded and chunked."""
+        if self._probes_memo is None:
+            self._probes_memo = self._scrape_config_builder().build_probes(
+                file_probes=cast(str, self.model.config.get("probes_file")),
+                relation_probes=self._probes_requirer.probes(),
+            )
+        return self._probes_memo
+
+    def _scrape_jobs(self) -> List[Dict]:
+        """All the scrape jobs to publish."""
+        if self._scrape_jobs_memo is None:
+            self._scrape_jobs_memo = self.self_scraping_job + self.probes_scraping_jobs
+        return self._scrape_jobs_memo
+
+    def _reset_memos(self):
+        """Forget the inputs computed so far in this dispatch, e.g. once the probes changed."""
+        self._modules_memo = None
+        self._probes_memo = None
+        self._scrape_jobs_memo = None
+        self._sized_requests_memo = None
+
     @property
     def probes_scraping_jobs(self):
         """The scraping jobs to execute probes from Prometheus."""
-        # Extract file and relation probes
-        file_probes_scrape_jobs = cast(str, self.model.config.get("probes_file"))
-        relation_probes_scrape_jobs = self._probes_requirer.probes()
-
-        builder = ScrapeConfigBuilder(self._external_url)
-        jobs = builder.build_probes_scraping_jobs(
-            file_probes=file_probes_scrape_jobs,
-            relation_probes=relation_probes_scrape_jobs,
-        )
+        with self._stage_timer.stage("probes_scraping_jobs") as span:
+            probe_sharding = cast(str, self.model.config.get("probe_sharding"))
+            shard_addresses = (
+                self._unit_addresses if probe_sharding in ("partition", "hashmod") else None
+            )
+            builder = self._scrape_config_builder(
+                shard_addresses=shard_addresses,
+                max_targets_per_job=cast(int, self.model.config.get("max_targets_per_job")),
+            )
+            jobs = builder.split_probes(self._probes())
+            if logger.isEnabledFor(logging.DEBUG):
+                # Serializing the jobs is not free, so only measure them when it gets logged
+                self._stage_timer.record_size(
+                    "probes_scraping_jobs", len(json.dumps(jobs)), span
+                )
 
         return jobs
 
     def _on_pebble_ready(self, _):
         """Event handler for PebbleReadyEvent."""
-        self._common_exit_hook()
+        # A (re)started container has lost whatever was pushed to it before
+        self._common_exit_hook(force=True)
 
     def _on_config_changed(self, _):
         """Event handler for ConfigChangedEvent."""
@@ -330,10 +641,20 @@ class BlackboxExporterCharm(CharmBase):
         """Event handler for replica's UpgradeCharmEvent."""
         # After upgrade (refresh), the unit ip address is not guaranteed to remain the same, and
         # the config may need update. Calling the common hook to update.
-        self._common_exit_hook()
+        self._stored.resources_ready_key = ""
+        self._common_exit_hook(force=True)
 
     def _on_probes_modules_config_changed(self, _):
         """Event handler for probes target changed."""
+        # Observed before the scrape jobs are republished and the resources patched again, so
+        # they will reflect the change
+        self._reset_memos()
+        self._common_exit_hook()
+
+    def _on_replicas_changed(self, _):
+        """Event handler for units joining or leaving the application."""
+        # Observed before the scrape jobs are republished, so they will reflect the change
+        self._reset_memos()
         self._common_exit_hook()
 
 
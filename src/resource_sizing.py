@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Estimate the resources Blackbox Exporter needs to serve a set of probe jobs."""
+
+import math
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Dict, List, Mapping
+
+from lightkube.utils.quantity import parse_quantity
+
+from scrape_config_builder import (
+    DEFAULT_SCRAPE_INTERVAL,
+    DEFAULT_SCRAPE_TIMEOUT,
+    duration_seconds,
+)
+
+# The exporter's own footprint, before probing anything
+BASE_CPU = 0.05
+BASE_MEMORY = 64 * 2**20
+
+# Requests are rounded up to these steps
+CPU_STEP = 0.05
+MEMORY_STEP = 16 * 2**20
+
+# Estimated limits are this many times the requests
+LIMITS_RATIO = 2
+
+# Requests are only updated when they move by more than this ratio
+HYSTERESIS = Decimal("0.2")
+
+
+@dataclass(frozen=True)
+class ProbeCost:
+    """What a single probe costs the exporter."""
+
+    cpu: float
+    """CPU time, in seconds."""
+    memory: int
+    """Memory held while the probe is in flight, in bytes."""
+
+
+PROBER_COSTS = {
+    "http": ProbeCost(cpu=0.004, memory=512 * 2**10),
+    "grpc": ProbeCost(cpu=0.004, memory=512 * 2**10),
+    "tcp": ProbeCost(cpu=0.001, memory=128 * 2**10),
+    "dns": ProbeCost(cpu=0.001, memory=128 * 2**10),
+    "icmp": ProbeCost(cpu=0.0005, memory=64 * 2**10),
+    "unix": ProbeCost(cpu=0.0005, memory=64 * 2**10),
+}
+
+
+def estimate_resource_requests(
+    jobs: List[Dict[str, Any]], modules: Mapping[str, Any], shards: int = 1
+) -> Dict[str, str]:
+    """Estimate the cpu and memory requests of a unit serving probe jobs.
+
+    Each job's targets are probed once per scrape interval, each probe costing the CPU of
+    its prober type, and staying in flight, holding memory, for at most the scrape timeout.
+
+    Args:
+        jobs: the probe jobs, not sharded.
+        modules: the blackbox modules, by name, to get the jobs' prober types.
+        shards: the number of units the jobs are spread across.
+
+    Returns:
+        The "cpu" and "memory" requests, as Kubernetes quantities.
+    """
+    cpu = 0.0
+    memory = 0.0
+    for job in jobs:
+        targets = sum(len(sc.get("targets", [])) for sc in job.get("static_configs", []))
+        module = next(iter(job.get("params", {}).get("module", [])), "http_2xx")
+        prober = (modules.get(module) or {}).get("prober", "http")
+        cost = PROBER_COSTS.get(prober, PROBER_COSTS["http"])
+        interval = duration_seconds(job.get("scrape_interval")) or DEFAULT_SCRAPE_INTERVAL
+        timeout = duration_seconds(job.get("scrape_timeout")) or DEFAULT_SCRAPE_TIMEOUT
+        rate = targets / interval
+        cpu += rate * cost.cpu
+        # Probes in flight at any time, by Little's law
+        memory += rate * timeout * cost.memory
+
+    shards = max(1, shards)
+    cpu_steps = math.ceil((BASE_CPU + cpu / shards) / CPU_STEP)
+    memory_steps = math.ceil((BASE_MEMORY + memory / shards) / MEMORY_STEP)
+    return {
+        "cpu": f"{round(cpu_steps * CPU_STEP * 1000)}m",
+        "memory": f"{memory_steps * MEMORY_STEP // 2**20}Mi",
+    }
+
+
+def apply_hysteresis(current: Mapping[str, str], proposed: Mapping[str, str]) -> Dict[str, str]:
+    """Keep the current requests unless the proposed ones moved by more than `HYSTERESIS`.
+
+    Every change of requests re-patches the StatefulSet, which restarts the pods, so small
+    fluctuations of the probe volume are absorbed.
+
+    Args:
+        current: the requests in effect, e.g. those of the StatefulSet template.
+        proposed: the newly estimated requests.
+    """
+    result = {}
+    for resource, quantity in proposed.items():
+        kept = current.get(resource)
+        if kept:
+            delta = abs(parse_quantity(quantity) - parse_quantity(kept))  # pyright: ignore
+            if delta <= HYSTERESIS * parse_quantity(kept):  # pyright: ignore
+                result[resource] = kept
+                continue
+        result[resource] = quantity
+    return result
+
+
+def limits_from_requests(requests: Mapping[str, str]) -> Dict[str, str]:
+    """Limits leaving `LIMITS_RATIO` times the requests for bursts of probes."""
+    cpu = parse_quantity(requests["cpu"]) * LIMITS_RATIO  # pyright: ignore
+    memory = parse_quantity(requests["memory"]) * LIMITS_RATIO  # pyright: ignore
+    return {"cpu": f"{int(cpu * 1000)}m", "memory": f"{int(memory) // 2**20}Mi"}
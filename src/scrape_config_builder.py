@@ -4,21 +4,192 @@
 
 """Helper class to build scrape configurations for Blackbox Exporter."""
 
-from typing import Any, Dict, List
+import hashlib
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlparse
 
-import yaml
+import yaml_codec
+
+logger = logging.getLogger(__name__)
+
+
+# Prometheus' own defaults, for jobs that do not set them
+DEFAULT_SCRAPE_INTERVAL = 60.0
+DEFAULT_SCRAPE_TIMEOUT = 10.0
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h|d|w)")
+
+
+def parse_duration(duration: str) -> float:
+    """Parse a Prometheus or Go duration, such as "1m30s" or "500ms", into seconds.
+
+    Raises:
+        ValueError: if the duration is malformed.
+    """
+    duration = str(duration).strip()
+    if not duration or _DURATION_RE.sub("", duration):
+        raise ValueError(f"invalid duration: '{duration}'")
+    return sum(
+        float(value) * _DURATION_UNITS[unit] for value, unit in _DURATION_RE.findall(duration)
+    )
+
+
+def duration_seconds(duration: Optional[str]) -> float:
+    """Parse a duration into seconds, treating a missing or malformed one as zero."""
+    try:
+        return parse_duration(duration) if duration else 0
+    except ValueError:
+        return 0
+
+
+def format_duration(seconds: float) -> str:
+    """Format seconds as a Prometheus duration, which only takes integers."""
+    millis = round(seconds * 1000)
+    return f"{millis // 1000}s" if millis % 1000 == 0 else f"{millis}ms"
+
+
+def parse_scrape_tiers(raw: str) -> Dict[str, Dict[str, str]]:
+    """Parse the "scrape_tiers" configuration.
+
+    Args:
+        raw: a yaml mapping of module names or prober types to a `scrape_interval` and/or
+            a `scrape_timeout`.
+
+    Returns:
+        The tiers, keyed by module name or prober type.
+
+    Raises:
+        ValueError: if the tiers are malformed.
+    """
+    if not raw:
+        return {}
+    try:
+        tiers = yaml_codec.safe_load(raw) or {}
+    except yaml_codec.YAMLError as e:
+        raise ValueError(f"invalid YAML: {e}") from e
+    if not isinstance(tiers, dict):
+        raise ValueError("expected a mapping of module names or probers to tiers")
+    for name, tier in tiers.items():
+        if not isinstance(tier, dict) or not tier:
+            raise ValueError(f"tier '{name}' must set scrape_interval and/or scrape_timeout")
+        for key, value in tier.items():
+            if key not in ("scrape_interval", "scrape_timeout"):
+                raise ValueError(f"unknown key '{key}' in tier '{name}'")
+            parse_duration(value)
+    return tiers
+
+
+def _static_targets(probe: Dict[str, Any]) -> Iterator[Tuple[Dict[str, Any], str]]:
+    """Iterate over the targets of a probe, along with their static config."""
+    for static_config in probe.get("static_configs", []):
+        for target in static_config.get("targets", []):
+            yield static_config, target
+
+
+def _rendezvous_shard(key: str, shards: List[str]) -> str:
+    """Pick the shard a key belongs to, using rendezvous (highest random weight) hashing.
+
+    Adding or removing a shard only moves the keys that belonged to that shard.
+    """
+    return max(shards, key=lambda shard: hashlib.sha256(f"{shard}|{key}".encode()).digest())
+
+
+def _jump_bucket(key: str, buckets: int) -> int:
+    """Pick the bucket a key belongs to, using jump consistent hashing.
+
+    Unlike `_rendezvous_shard`, picking a bucket takes a logarithmic number of steps, and
+    going from `buckets` to `buckets + 1` only moves the keys that land in the new bucket.
+    """
+    state = int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        state = (state * 2862933555777941757 + 1) % 2**64
+        candidate = int((bucket + 1) * (2**31 / ((state >> 33) + 1)))
+    return bucket
 
 
 class ScrapeConfigBuilder:
     """Helper class to build scrape configurations for Blackbox Exporter."""
 
-    def __init__(self, external_url: str):
+    def __init__(
+        self,
+        external_url: str,
+        shard_addresses: Optional[List[str]] = None,
+        sharding_mode: str = "partition",
+        cache_dir: Optional[Path] = None,
+        max_targets_per_job: int = 0,
+        scrape_tiers: Optional[Dict[str, Dict[str, str]]] = None,
+        modules: Optional[Dict[str, Any]] = None,
+        deduplicate: bool = False,
+    ):
         """Initialize the ScrapeConfigBuilder.
 
         :param external_url: The external URL to be used for constructing probes' `metrics_path` and `relabel_configs`.
+        :param shard_addresses: The `host:port` addresses of the blackbox exporter units to
+            spread the probe targets across. If not set, all the targets are probed
+            through the external URL.
+        :param sharding_mode: How targets are spread across `shard_addresses`: "partition"
+            splits the target lists here, "hashmod" lets Prometheus split them with a
+            `hashmod` relabel step.
+        :param cache_dir: A directory where the parsed "probes_file" is cached, keyed by the
+            digest of its contents. If not set, the file is parsed every time.
+        :param max_targets_per_job: The number of targets above which a scrape job is split
+            into chunks of about as many targets. Zero (the default) means no limit.
+        :param scrape_tiers: The `scrape_interval` and `scrape_timeout` of the jobs, keyed by
+            module name or prober type, as returned by `parse_scrape_tiers`.
+        :param modules: The blackbox modules the exporter runs with, used to match the jobs'
+            modules with their prober type and timeout.
+        :param deduplicate: Whether to probe each target only once per set of `params`
+            (module included), even if several jobs list it.
         """
         self.external_url = external_url
+        self.shard_addresses = shard_addresses or []
+        self.sharding_mode = sharding_mode
+        self.cache_dir = cache_dir
+        self.max_targets_per_job = max_targets_per_job
+        self.scrape_tiers = scrape_tiers or {}
+        self.modules = modules or {}
+        self.deduplicate = deduplicate
+
+    def load_file_probes(self, file_probes: str) -> Dict[str, Any]:
+        """Parse the "probes_file" configuration, reusing the cached result if unchanged.
+
+        Args:
+            file_probes: the raw "probes_file" configuration (yaml).
+
+        Returns:
+            The parsed configuration, or an empty dict if there is none.
+        """
+        if not file_probes:
+            return {}
+        if not self.cache_dir:
+            return yaml_codec.safe_load(file_probes) or {}
+
+        digest = hashlib.sha256(file_probes.encode()).hexdigest()
+        cache_file = self.cache_dir / f"probes_file-{digest}.json"
+        try:
+            return json.loads(cache_file.read_text())
+        except (OSError, ValueError):
+            pass
+
+        parsed = yaml_codec.safe_load(file_probes) or {}
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            for stale in self.cache_dir.glob("probes_file-*.json"):
+                stale.unlink()
+            tmp_file = cache_file.with_suffix(".tmp")
+            tmp_file.write_text(json.dumps(parsed))
+            tmp_file.replace(cache_file)
+        except (OSError, TypeError, ValueError) as e:
+            # e.g. values YAML can represent but JSON cannot, such as dates
+            logger.debug("Not caching the parsed probes_file: %s", e)
+        return parsed
 
     def merge_scrape_configs(
         self, file_probes: Dict[str, Any], relation_probes: List[Dict[str, Any]]
@@ -48,12 +219,231 @@ class ScrapeConfigBuilder:
 
         return list(merged_scrape_configs.values())
 
-    def build_probes_scraping_jobs(
+    @staticmethod
+    def deduplicate_probes(probes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Keep a single occurrence of each target probed with the same `params`.
+
+        The first job listing a target keeps it, with the union of the labels given to it by
+        every job; on conflicting values, the first one wins. Jobs left without targets are
+        dropped.
+
+        Args:
+            probes: the merged file and relation probes.
+
+        Returns:
+            The probes, each (params, target) pair appearing only once.
+        """
+        # (params, target) -> index of the job keeping it, and the union of its labels
+        owners: Dict[Tuple[str, str], int] = {}
+        labels: Dict[Tuple[str, str], Dict[str, str]] = {}
+        for index, probe in enumerate(probes):
+            params = json.dumps(probe.get("params", {}), sort_keys=True)
+            for static_config, target in _static_targets(probe):
+                key = (params, target)
+                owners.setdefault(key, index)
+                target_labels = labels.setdefault(key, {})
+                for name, value in (static_config.get("labels") or {}).items():
+                    target_labels.setdefault(name, value)
+
+        deduplicated = []
+        for index, probe in enumerate(probes):
+            params = json.dumps(probe.get("params", {}), sort_keys=True)
+            # Targets ending up with the same labels share a static config again
+            static_configs: Dict[str, Dict[str, Any]] = {}
+            for static_config, target in _static_targets(probe):
+                key = (params, target)
+                if owners.get(key) != index:
+                    continue
+                # Only keep the target once, even if listed twice by the same job
+                del owners[key]
+                new_config = {**static_config, "targets": []}
+                if labels[key]:
+                    new_config["labels"] = labels[key]
+                group = json.dumps({**new_config, "targets": None}, sort_keys=True)
+                static_configs.setdefault(group, new_config)["targets"].append(target)
+            if static_configs:
+                deduplicated.append({**probe, "static_configs": list(static_configs.values())})
+        return deduplicated
+
+    @staticmethod
+    def _relabel_configs(address: str) -> List[Dict[str, Any]]:
+        """The Blackbox Exporter's `relabel_configs`, probing through `address`."""
+        return [
+            {"source_labels": ["__address__"], "target_label": "__param_target"},
+            {"source_labels": ["__param_target"], "target_label": "instance"},
+            {"source_labels": ["__param_target"], "target_label": "probe_target"},
+            {"target_label": "__address__", "replacement": address},
+        ]
+
+    def partition_probe(self, probe: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Split the targets of a probe across the shards.
+
+        Each target goes to a shard picked by consistent hashing over the target and the
+        probe's modules, so scaling the application only moves the targets of the shards
+        that were added or removed.
+
+        Args:
+            probe: a scrape job with blackbox relabel configs.
+
+        Returns:
+            One job per shard that got targets, named after the shard's index and scraping
+            the shard's address directly.
+        """
+        modules = ",".join(probe.get("params", {}).get("module", []))
+        shard_configs: Dict[str, List[Dict[str, Any]]] = {}
+        for static_config in probe.get("static_configs", []):
+            shard_targets: Dict[str, List[str]] = {}
+            for target in static_config.get("targets", []):
+                shard = _rendezvous_shard(f"{modules}|{target}", self.shard_addresses)
+                shard_targets.setdefault(shard, []).append(target)
+            for shard, targets in shard_targets.items():
+                shard_configs.setdefault(shard, []).append({**static_config, "targets": targets})
+
+        return [
+            {
+                **probe,
+                "job_name": f"{probe['job_name']}_shard{index}",
+                "static_configs": shard_configs[address],
+                # Units serve the probe endpoint at the root, unlike the ingress
+                "metrics_path": "/probe",
+                "relabel_configs": self._relabel_configs(address),
+            }
+            for index, address in enumerate(self.shard_addresses)
+            if address in shard_configs
+        ]
+
+    def hashmod_probe(self, probe: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Copy a probe once per shard, letting Prometheus split the targets.
+
+        Each copy keeps the full target list, hashes `__param_target` modulo the number of
+        shards and only keeps the targets matching its own shard's index. Unlike
+        `partition_probe`, changing the number of shards reshuffles most targets.
+
+        Args:
+            probe: a scrape job with blackbox relabel configs.
+
+        Returns:
+            One job per shard, named after the shard's index and scraping the shard's
+            address directly.
+        """
+        jobs = []
+        for index, address in enumerate(self.shard_addresses):
+            relabel_configs = self._relabel_configs(address)
+            # Right after `__param_target` is set from `__address__`
+            relabel_configs[1:1] = [
+                {
+                    "source_labels": ["__param_target"],
+                    "modulus": len(self.shard_addresses),
+                    "target_label": "__tmp_blackbox_shard",
+                    "action": "hashmod",
+                },
+                {
+                    "source_labels": ["__tmp_blackbox_shard"],
+                    "regex": str(index),
+                    "action": "keep",
+                },
+            ]
+            jobs.append(
+                {
+                    **probe,
+                    "job_name": f"{probe['job_name']}_shard{index}",
+                    # Units serve the probe endpoint at the root, unlike the ingress
+                    "metrics_path": "/probe",
+                    "relabel_configs": relabel_configs,
+                }
+            )
+        return jobs
+
+    def apply_scrape_tier(self, probe: Dict[str, Any]) -> Dict[str, Any]:
+        """Set the `scrape_interval` and `scrape_timeout` of a probe from its tier.
+
+        The tier is looked up by the probe's module (the first one, which is the one the
+        exporter runs), then by the module's prober type. Values set by the probe itself are
+        kept. The scrape timeout is raised above the module's timeout if needed, so that
+        Prometheus does not give up before the exporter does. Prometheus rejects a timeout
+        longer than the interval, so whenever a timeout is set, the interval is set too,
+        raised to the timeout if needed, including when it was left to Prometheus' default.
+
+        Args:
+            probe: a scrape job.
+
+        Returns:
+            The probe, updated in place.
+        """
+        module_name = next(iter(probe.get("params", {}).get("module", [])), None)
+        module = self.modules.get(module_name) or {}
+        tier = self.scrape_tiers.get(module_name) or self.scrape_tiers.get(module.get("prober"))
+        if not tier:
+            return probe
+
+        for key, value in tier.items():
+            probe.setdefault(key, value)
+
+        module_timeout = duration_seconds(module.get("timeout"))
+        if module_timeout and duration_seconds(probe.get("scrape_timeout")) <= module_timeout:
+            probe["scrape_timeout"] = format_duration(module_timeout + 1)
+        scrape_timeout = duration_seconds(probe.get("scrape_timeout"))
+        if not scrape_timeout:
+            return probe
+        if "scrape_interval" not in probe:
+            probe["scrape_interval"] = format_duration(
+                max(DEFAULT_SCRAPE_INTERVAL, scrape_timeout)
+            )
+        elif duration_seconds(probe["scrape_interval"]) < scrape_timeout:
+            logger.warning(
+                "Raising the scrape_interval of %s to its scrape_timeout", probe["job_name"]
+            )
+            probe["scrape_interval"] = format_duration(scrape_timeout)
+        return probe
+
+    def chunk_probe(self, probe: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Split a probe into jobs of about `max_targets_per_job` targets each.
+
+        The targets keep the labels of their static config, and are hashed into as many
+        chunks as needed to hold them, so a target stays in the same chunk, and keeps its
+        `job` label, when other targets are added to or removed from the probe. Prometheus
+        derives the scrape offset of each target from its labels, `job` included, so the
+        chunks are scraped at different offsets within the interval rather than all at once.
+
+        Args:
+            probe: a scrape job.
+
+        Returns:
+            The probe itself if it is small enough, otherwise one job per non-empty chunk,
+            named after the chunk's index.
+        """
+        size = self.max_targets_per_job
+        targets = [
+            (index, target)
+            for index, static_config in enumerate(probe.get("static_configs", []))
+            for target in static_config.get("targets", [])
+        ]
+        if size <= 0 or len(targets) <= size:
+            return [probe]
+
+        chunks: List[Dict[int, Dict[str, Any]]] = [{} for _ in range(-(-len(targets) // size))]
+        for index, target in targets:
+            static_configs = chunks[_jump_bucket(target, len(chunks))]
+            static_config = static_configs.setdefault(
+                index, {**probe["static_configs"][index], "targets": []}
+            )
+            static_config["targets"].append(target)
+        return [
+            {
+                **probe,
+                "job_name": f"{probe['job_name']}_chunk{chunk}",
+                "static_configs": list(static_configs.values()),
+            }
+            for chunk, static_configs in enumerate(chunks)
+            if static_configs
+        ]
+
+    def build_probes(
         self,
         file_probes: str,
         relation_probes: List[Dict[str, Any]],
     ) -> List[Dict[str, Any]]:
-        """Build list of probes scraping jobs.
+        """Build the list of probes, before they are sharded and chunked.
 
         Args:
             file_probes: data parsed from the "probes_file" configuration, loaded as a dictionary.
@@ -61,29 +451,59 @@ class ScrapeConfigBuilder:
             relation_probes: a list of dicts probes extracted from a relation.
 
         Returns:
-            A list of scraping jobs with blackbox relabel configs.
+            A list of scraping jobs with blackbox relabel configs, pointing at the external URL.
         """
         external_url = urlparse(self.external_url)
         probes_path = f"{external_url.path.rstrip('/')}/probe"
         external_url_port = f":{external_url.port}" if external_url.port else ""
 
-        file_probes_scrape_jobs_dict = yaml.safe_load(file_probes) if file_probes else {}
+        file_probes_scrape_jobs_dict = self.load_file_probes(file_probes)
 
         merged_scrape_configs = self.merge_scrape_configs(
             file_probes_scrape_jobs_dict, relation_probes
         )
+        if self.deduplicate:
+            merged_scrape_configs = self.deduplicate_probes(merged_scrape_configs)
 
         # Add the Blackbox Exporter's `relabel_configs` to each job
         for probe in merged_scrape_configs:
             probe["metrics_path"] = probes_path
-            probe["relabel_configs"] = [
-                {"source_labels": ["__address__"], "target_label": "__param_target"},
-                {"source_labels": ["__param_target"], "target_label": "instance"},
-                {"source_labels": ["__param_target"], "target_label": "probe_target"},
-                {
-                    "target_label": "__address__",
-                    "replacement": f"{external_url.hostname}{external_url_port}",
-                },
-            ]
+            probe["relabel_configs"] = self._relabel_configs(
+                f"{external_url.hostname}{external_url_port}"
+            )
+            if self.scrape_tiers:
+                self.apply_scrape_tier(probe)
 
         return merged_scrape_configs
+
+    def split_probes(self, probes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Shard and chunk probes, as returned by `build_probes`, into scraping jobs.
+
+        The probes are not modified; jobs that need no splitting are the probes themselves.
+        """
+        jobs = probes
+        if self.shard_addresses:
+            split = self.hashmod_probe if self.sharding_mode == "hashmod" else self.partition_probe
+            jobs = [job for probe in jobs for job in split(probe)]
+
+        if self.max_targets_per_job > 0:
+            jobs = [job for probe in jobs for job in self.chunk_probe(probe)]
+
+        return jobs
+
+    def build_probes_scraping_jobs(
+        self,
+        file_probes: str,
+        relation_probes: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """Build list of probes scraping jobs.
+
+        Args:
+            file_probes: data parsed from the "probes_file" configuration, loaded as a dictionary.
+                Defaults to an empty dictionary if no valid YAML or config entry is found.
+            relation_probes: a list of dicts probes extracted from a relation.
+
+        Returns:
+            A list of scraping jobs with blackbox relabel configs.
+        """
+        return self.split_probes(self.build_probes(file_probes, relation_probes))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Helper class to time the stages of the charm reconcile pipeline."""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import opentelemetry.trace
+from opentelemetry.trace import Span
+
+tracer = opentelemetry.trace.get_tracer(__name__)
+
+
+class StageTimer:
+    """Time named stages, both as tracing spans and as a summary for the logs.
+
+    Spans are exported through the charm tracing integration, if any. Durations (and,
+    optionally, byte counts) are accumulated per stage so they can be logged at the end
+    of the dispatch.
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.sizes: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Span]:
+        """Time the enclosed block as the stage `name`."""
+        start = time.perf_counter()
+        try:
+            with tracer.start_as_current_span(name) as span:
+                yield span
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
+
+    def record_size(self, name: str, size: int, span: Span) -> None:
+        """Record the number of bytes handled by the stage `name`."""
+        self.sizes[name] = size
+        span.set_attribute("bytes", size)
+
+    def summary(self) -> str:
+        """A one-line summary of the timed stages, in the order they first ran."""
+        stages = []
+        for name, duration in self.durations.items():
+            stage = f"{name}={duration * 1000:.1f}ms"
+            if name in self.sizes:
+                stage += f" ({self.sizes[name]}B)"
+            stages.append(stage)
+        return ", ".join(stages)
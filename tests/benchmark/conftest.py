@@ -0,0 +1,113 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Fixtures and reporting for the blackbox-exporter-k8s benchmarks.
+
+The size of the synthesized fleet is controlled with environment variables:
+`BENCH_RELATIONS` probes relations, each providing `BENCH_PROBES` probes (jobs) of
+`BENCH_TARGETS` targets. Results are printed at the end of the session and, if
+`BENCH_OUTPUT` is set, written to that path as JSON so that runs can be compared.
+"""
+
+import gc
+import json
+import os
+import time
+import tracemalloc
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass
+from typing import Callable, List
+from unittest.mock import MagicMock, patch
+
+import pytest
+from synthetic import Fleet
+
+from blackbox import BlackboxExporterApi
+from charm import BlackboxExporterCharm
+
+ROUNDS = int(os.environ.get("BENCH_ROUNDS", 5))
+
+
+@dataclass
+class Measurement:
+    """Best wall-clock time and peak traced memory of a benchmarked call."""
+
+    name: str
+    fleet: str
+    seconds: float
+    peak_bytes: int
+
+
+_RESULTS: List[Measurement] = []
+
+
+@pytest.fixture(scope="session")
+def fleet() -> Fleet:
+    return Fleet()
+
+
+@pytest.fixture
+def measure(fleet, request) -> Callable:
+    """Benchmark a callable; return the result of its last call.
+
+    The callable is timed over `BENCH_ROUNDS` rounds, keeping the best one, and run once
+    more under tracemalloc to get its peak memory.
+    """
+
+    def _measure(func: Callable, name: str = ""):
+        name = name or request.node.name
+        best = float("inf")
+        for _ in range(ROUNDS):
+            gc.collect()
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            result = func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        _RESULTS.append(Measurement(name, str(fleet), best, peak))
+        return result
+
+    return _measure
+
+
+@pytest.fixture
+def patch_all(tmp_path):
+    """Patch out the Kubernetes API, the exporter HTTP API and the pod FQDN.
+
+    The charm caches are kept in a per-test directory.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(patch.object(BlackboxExporterCharm, "_cache_dir", tmp_path))
+        stack.enter_context(patch.object(BlackboxExporterApi, "reload", new=MagicMock()))
+        stack.enter_context(patch("lightkube.core.client.GenericSyncClient", new=MagicMock()))
+        stack.enter_context(patch("socket.getfqdn", new=lambda *args: "fqdn"))
+        stack.enter_context(
+            patch.multiple(
+                "charm.KubernetesComputeResourcesPatch",
+                _namespace="test-namespace",
+                _patch=lambda *_, **__: True,
+                is_ready=lambda *_, **__: True,
+            )
+        )
+        yield
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Print (and optionally save) the benchmark results."""
+    if not _RESULTS:
+        return
+    terminalreporter.section("benchmark results (relations x probes x targets)")
+    for result in _RESULTS:
+        terminalreporter.write_line(
+            f"{result.name:<55} {result.fleet:>12} "
+            f"{result.seconds * 1000:>10.2f} ms {result.peak_bytes / 2**20:>9.2f} MiB"
+        )
+    if output := os.environ.get("BENCH_OUTPUT"):
+        with open(output, "w") as f:
+            json.dump([asdict(result) for result in _RESULTS], f, indent=2)
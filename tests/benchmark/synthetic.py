@@ -0,0 +1,58 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Synthesized probes fleets for the benchmarks."""
+
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List
+
+
+@dataclass(frozen=True)
+class Fleet:
+    """Shape of the synthesized probes fleet."""
+
+    relations: int = int(os.environ.get("BENCH_RELATIONS", 20))
+    probes: int = int(os.environ.get("BENCH_PROBES", 10))
+    targets: int = int(os.environ.get("BENCH_TARGETS", 50))
+
+    def __str__(self):
+        """Shape of the fleet, as `relations x probes x targets`."""
+        return f"{self.relations}x{self.probes}x{self.targets}"
+
+
+def synthesize_probes(app: str, fleet: Fleet) -> List[Dict]:
+    """Probes a provider application could send, with `fleet.targets` targets each."""
+    return [
+        {
+            "job_name": f"juju_{app}_job_{probe}",
+            "params": {"module": ["http_2xx" if probe % 2 else "icmp"]},
+            "static_configs": [
+                {
+                    "targets": [
+                        f"http://{app}-{probe}-{target}.example.com"
+                        for target in range(fleet.targets)
+                    ],
+                    "labels": {"app": app, "probe": str(probe)},
+                }
+            ],
+        }
+        for probe in range(fleet.probes)
+    ]
+
+
+def synthesize_databag(app: str, fleet: Fleet) -> Dict[str, str]:
+    """The application databag of a probes provider."""
+    return {
+        "scrape_metadata": json.dumps(
+            {
+                "model": "bench",
+                "model_uuid": "12de4fae-06cc-4ceb-9089-567be09fec78",
+                "application": app,
+                "unit": f"{app}/0",
+            }
+        ),
+        "scrape_probes": json.dumps(synthesize_probes(app, fleet)),
+        "scrape_modules": json.dumps({f"juju_{app}_http_2xx_slow": {"prober": "http"}}),
+    }
@@ -0,0 +1,63 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmarks of full charm dispatches over a large probes fleet."""
+
+import pytest
+from ops import testing
+from synthetic import synthesize_databag
+
+from charm import BlackboxExporterCharm
+
+pytestmark = pytest.mark.usefixtures("patch_all")
+
+VERSION_EXEC = testing.Exec(
+    command_prefix=["blackbox_exporter", "--version"],
+    stdout="blackbox_exporter, version 0.25.0 (branch: HEAD, revision: abc123)",
+)
+
+
+@pytest.fixture
+def context():
+    return testing.Context(BlackboxExporterCharm, charm_root=".")
+
+
+@pytest.fixture
+def state(fleet):
+    probes_relations = [
+        testing.Relation(
+            endpoint="probes",
+            interface="blackbox_exporter_probes",
+            remote_app_name=f"provider{i}",
+            remote_app_data=synthesize_databag(f"provider{i}", fleet),
+        )
+        for i in range(fleet.relations)
+    ]
+    prometheus = testing.Relation(
+        endpoint="self-metrics-endpoint",
+        interface="prometheus_scrape",
+        remote_app_name="prometheus",
+    )
+    container = testing.Container("blackbox", can_connect=True, execs={VERSION_EXEC})
+    return testing.State(
+        leader=True, containers=[container], relations=[*probes_relations, prometheus]
+    )
+
+
+def test_config_changed(context, state, measure):
+    state_out = measure(lambda: context.run(context.on.config_changed(), state))
+    assert state_out.unit_status == testing.ActiveStatus()
+
+
+def test_set_scrape_job_spec(context, state, measure):
+    with context(context.on.update_status(), state) as manager:
+        charm = manager.charm
+
+        def set_scrape_job_spec():
+            # The jobs, and the probes they are built from, are memoized for the dispatch:
+            # time them from scratch every round
+            charm._reset_memos()
+            charm._scraping.set_scrape_job_spec()
+
+        measure(set_scrape_job_spec)
+        manager.run()
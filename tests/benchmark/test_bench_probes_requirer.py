@@ -0,0 +1,69 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmarks of BlackboxProbesRequirer over a large probes fleet."""
+
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from charms.blackbox_exporter_k8s.v0.blackbox_probes import BlackboxProbesRequirer
+from ops.charm import CharmBase
+from ops.testing import Harness
+from synthetic import synthesize_databag
+
+META = """
+name: requirer-bench
+requires:
+  probes:
+    interface: blackbox_exporter_probes
+"""
+
+
+class RequirerCharm(CharmBase):
+    cache_dir: Optional[Path] = None
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.probes_requirer = BlackboxProbesRequirer(self, "probes", cache_dir=self.cache_dir)
+
+
+@pytest.fixture
+def requirer(fleet, tmp_path, monkeypatch):
+    monkeypatch.setattr(RequirerCharm, "cache_dir", tmp_path)
+    harness = Harness(RequirerCharm, meta=META)
+    harness.begin()
+    for i in range(fleet.relations):
+        app = f"provider{i}"
+        rel_id = harness.add_relation("probes", app)
+        harness.update_relation_data(rel_id, app, synthesize_databag(app, fleet))
+    yield harness.charm.probes_requirer
+    harness.cleanup()
+
+
+def _invalidate(requirer):
+    requirer._stored.relation_cache = {}
+
+
+def test_probes_cold(requirer, measure, fleet):
+    def cold_probes():
+        _invalidate(requirer)
+        return requirer.probes()
+
+    probes = measure(cold_probes)
+    assert len(probes) == fleet.relations * fleet.probes
+
+
+def test_probes_warm(requirer, measure, fleet):
+    requirer.probes()
+    probes = measure(requirer.probes)
+    assert len(probes) == fleet.relations * fleet.probes
+
+
+def test_modules_cold(requirer, measure, fleet):
+    def cold_modules():
+        _invalidate(requirer)
+        return requirer.modules()
+
+    modules = measure(cold_modules)
+    assert len(modules) == fleet.relations
@@ -0,0 +1,28 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmarks of ScrapeConfigBuilder over a large probes fleet."""
+
+import copy
+
+import yaml
+from synthetic import synthesize_probes
+
+from scrape_config_builder import ScrapeConfigBuilder
+
+
+def test_build_probes_scraping_jobs(measure, fleet):
+    relation_probes = [
+        probe
+        for i in range(fleet.relations)
+        for probe in synthesize_probes(f"provider{i}", fleet)
+    ]
+    file_probes = yaml.safe_dump({"scrape_configs": synthesize_probes("file", fleet)})
+    builder = ScrapeConfigBuilder("http://blackbox-exporter:9115")
+
+    jobs = measure(
+        lambda: builder.build_probes_scraping_jobs(
+            file_probes=file_probes, relation_probes=copy.deepcopy(relation_probes)
+        )
+    )
+    assert len(jobs) == (fleet.relations + 1) * fleet.probes
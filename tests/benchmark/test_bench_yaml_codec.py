@@ -0,0 +1,47 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmarks of the YAML codec, with and without the LibYAML bindings."""
+
+from unittest.mock import patch
+
+import pytest
+import yaml
+from synthetic import synthesize_probes
+
+import yaml_codec
+
+
+@pytest.fixture(params=["libyaml", "python"])
+def codec(request):
+    """The YAML codec, forced to the pure-Python implementation for the "python" run."""
+    if request.param == "libyaml" and not yaml_codec.LIBYAML:
+        pytest.skip("PyYAML was built without the LibYAML bindings")
+    if request.param == "python":
+        with patch.object(yaml_codec, "SafeLoader", yaml.SafeLoader), patch.object(
+            yaml_codec, "SafeDumper", yaml.SafeDumper
+        ):
+            yield request.param
+    else:
+        yield request.param
+
+
+@pytest.fixture
+def probes_file(fleet):
+    """A "probes_file" with as many probes as the whole fleet."""
+    return {
+        "scrape_configs": [
+            probe for i in range(fleet.relations) for probe in synthesize_probes(f"app{i}", fleet)
+        ]
+    }
+
+
+def test_safe_load(measure, codec, probes_file):
+    rendered = yaml.safe_dump(probes_file)
+    parsed = measure(lambda: yaml_codec.safe_load(rendered))
+    assert parsed == probes_file
+
+
+def test_safe_dump(measure, codec, probes_file):
+    rendered = measure(lambda: yaml_codec.safe_dump(probes_file))
+    assert yaml.safe_load(rendered) == probes_file
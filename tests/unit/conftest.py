@@ -21,13 +21,15 @@ VERSION_EXEC = testing.Exec(
 
 
 @pytest.fixture
-def patch_all():
+def patch_all(tmp_path):
     """Patch external dependencies so scenario tests exercise Python logic in isolation.
 
     Stubs out the BlackboxExporter HTTP reload, container config push, lightkube
-    k8s client, socket.getfqdn, and the KubernetesComputeResourcesPatch lifecycle.
+    k8s client, socket.getfqdn, and the KubernetesComputeResourcesPatch lifecycle,
+    and keeps the charm caches in a per-test directory.
     """
     with ExitStack() as stack:
+        stack.enter_context(patch.object(BlackboxExporterCharm, "_cache_dir", tmp_path))
         stack.enter_context(patch.object(BlackboxExporterApi, "reload", tautology))
         stack.enter_context(patch.object(WorkloadManager, "push_config", new=MagicMock()))
         stack.enter_context(patch("lightkube.core.client.GenericSyncClient", new=MagicMock()))
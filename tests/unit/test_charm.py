@@ -2,12 +2,20 @@
 # Copyright 2021 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import dataclasses
+import json
+import logging
 import unittest
 from unittest.mock import patch
 
 import ops
 import pytest
 import yaml
+from charms.observability_libs.v0.kubernetes_compute_resources_patch import (
+    KubernetesComputeResourcesPatch,
+    ResourcePatcher,
+    ResourceRequirements,
+)
 from helpers import k8s_resource_multipatch, tautology
 from ops import testing
 from ops.model import ActiveStatus, BlockedStatus
@@ -15,6 +23,7 @@ from ops.testing import Harness
 
 from blackbox import BlackboxExporterApi, WorkloadManager
 from charm import BlackboxExporterCharm
+from scrape_config_builder import ScrapeConfigBuilder
 
 ops.testing.SIMULATE_CAN_CONNECT = True  # pyright: ignore
 
@@ -117,3 +126,496 @@ def test_smoke(context, container):
     state_out = context.run(context.on.pebble_ready(container), state_in)
     # THEN the charm reaches ActiveStatus
     assert state_out.unit_status == testing.ActiveStatus()
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_unchanged_inputs_skip_workload_reconcile(context, container):
+    # GIVEN a charm whose workload was already reconciled
+    state = context.run(
+        context.on.config_changed(), testing.State(leader=True, containers=[container])
+    )
+    # WHEN update-status fires and none of the workload inputs changed
+    with patch.object(WorkloadManager, "update_layer") as update_layer:
+        state_out = context.run(context.on.update_status(), state)
+    # THEN the workload is left untouched and the charm stays active
+    update_layer.assert_not_called()
+    assert state_out.unit_status == testing.ActiveStatus()
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_changed_inputs_trigger_workload_reconcile(context, container):
+    # GIVEN a charm whose workload was already reconciled
+    state = context.run(
+        context.on.config_changed(), testing.State(leader=True, containers=[container])
+    )
+    # WHEN the config changes
+    state = dataclasses.replace(state, config={"config_file": yaml.dump({"modules": {}})})
+    with patch.object(WorkloadManager, "update_layer") as update_layer:
+        context.run(context.on.config_changed(), state)
+    # THEN the workload is reconciled again
+    update_layer.assert_called_once()
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_pebble_ready_always_reconciles_workload(context, container):
+    # GIVEN a charm whose workload was already reconciled
+    state = context.run(
+        context.on.config_changed(), testing.State(leader=True, containers=[container])
+    )
+    # WHEN the container is restarted
+    with patch.object(WorkloadManager, "update_layer") as update_layer:
+        context.run(context.on.pebble_ready(state.get_container("blackbox")), state)
+    # THEN the workload is reconciled even though no input changed
+    update_layer.assert_called_once()
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_reload_only_when_config_changed(context, container):
+    # GIVEN a charm whose workload was already reconciled
+    with patch.object(BlackboxExporterApi, "reload") as reload:
+        state = context.run(
+            context.on.config_changed(), testing.State(leader=True, containers=[container])
+        )
+        # THEN the initial replan loaded the config, so no reload was needed
+        reload.assert_not_called()
+
+        # WHEN update-status fires without any change
+        state = context.run(context.on.update_status(), state)
+        # THEN the running exporter is not reloaded
+        reload.assert_not_called()
+
+        # WHEN the config file changes
+        state = dataclasses.replace(state, config={"config_file": yaml.dump({"modules": {}})})
+        context.run(context.on.config_changed(), state)
+        # THEN the exporter is reloaded
+        reload.assert_called_once()
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_reloads_are_coalesced_within_a_dispatch(context, container):
+    # GIVEN a charm whose workload was already reconciled
+    state = context.run(
+        context.on.config_changed(), testing.State(leader=True, containers=[container])
+    )
+    # WHEN several reconciles push config changes during a single dispatch
+    with patch.object(BlackboxExporterApi, "reload") as reload:
+        with context(context.on.update_status(), state) as mgr:
+            mgr.charm._common_exit_hook(force=True)
+            mgr.charm._common_exit_hook(force=True)
+            mgr.run()
+    # THEN the exporter is reloaded only once
+    reload.assert_called_once()
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_reconcile_stages_are_logged(context, container, caplog):
+    # GIVEN a charm with no relations
+    state_in = testing.State(leader=True, containers=[container])
+    # WHEN the workload is reconciled
+    with caplog.at_level(logging.DEBUG, logger="charm"):
+        context.run(context.on.config_changed(), state_in)
+    # THEN the duration of each stage is logged
+    (summary,) = [r.message for r in caplog.records if r.message.startswith("Reconcile stages")]
+    for stage in ("build_config", "push_config", "update_layer"):
+        assert f"{stage}=" in summary
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_partition_sharding_points_jobs_at_units(context, container):
+    # GIVEN a charm with three units, sharding its probes by partition
+    probes_file = yaml.safe_dump(
+        {
+            "scrape_configs": [
+                {
+                    "job_name": "file_job",
+                    "params": {"module": ["icmp"]},
+                    "static_configs": [{"targets": [f"10.0.0.{i}" for i in range(50)]}],
+                }
+            ]
+        }
+    )
+    state = testing.State(
+        leader=True,
+        containers=[container],
+        planned_units=3,
+        config={"probes_file": probes_file, "probe_sharding": "partition"},
+    )
+
+    # WHEN the probes scraping jobs are built
+    with context(context.on.config_changed(), state) as mgr:
+        jobs = mgr.charm.probes_scraping_jobs
+        state_out = mgr.run()
+
+    # THEN each job scrapes a single unit through its in-cluster address
+    addresses = {job["relabel_configs"][-1]["replacement"] for job in jobs}
+    assert addresses == {
+        f"blackbox-exporter-k8s-{i}.blackbox-exporter-k8s-endpoints.{state.model.name}"
+        f".svc.cluster.local:9115"
+        for i in range(3)
+    }
+    assert state_out.unit_status == testing.ActiveStatus()
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_partition_sharding_follows_scale_down(context, container):
+    # GIVEN a leader publishing jobs partitioned across three units
+    probes_file = yaml.safe_dump(
+        {
+            "scrape_configs": [
+                {
+                    "job_name": "file_job",
+                    "params": {"module": ["icmp"]},
+                    "static_configs": [{"targets": [f"10.0.0.{i}" for i in range(50)]}],
+                }
+            ]
+        }
+    )
+    prometheus = testing.Relation("self-metrics-endpoint", remote_app_name="prometheus")
+    replicas = testing.PeerRelation("replicas", peers_data={1: {}, 2: {}})
+    state = testing.State(
+        leader=True,
+        containers=[container],
+        relations=[prometheus, replicas],
+        planned_units=3,
+        config={"probes_file": probes_file, "probe_sharding": "partition"},
+    )
+    state = context.run(context.on.config_changed(), state)
+
+    # WHEN the application is scaled down to two units
+    state = dataclasses.replace(state, planned_units=2)
+    state_out = context.run(
+        context.on.relation_departed(replicas, remote_unit=2, departing_unit=2), state
+    )
+
+    # THEN the published jobs only point at the remaining units
+    jobs = json.loads(state_out.get_relation(prometheus.id).local_app_data["scrape_jobs"])
+    addresses = {
+        job["relabel_configs"][-1]["replacement"] for job in jobs if "relabel_configs" in job
+    }
+    assert {address.split(".", 1)[0] for address in addresses} == {
+        "blackbox-exporter-k8s-0",
+        "blackbox-exporter-k8s-1",
+    }
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_hashmod_sharding_follows_scale_up(context, container):
+    # GIVEN a leader publishing hashmod jobs for two units
+    probes_file = yaml.safe_dump(
+        {
+            "scrape_configs": [
+                {
+                    "job_name": "file_job",
+                    "params": {"module": ["icmp"]},
+                    "static_configs": [{"targets": ["10.0.0.1", "10.0.0.2"]}],
+                }
+            ]
+        }
+    )
+    prometheus = testing.Relation("self-metrics-endpoint", remote_app_name="prometheus")
+    replicas = testing.PeerRelation("replicas", peers_data={1: {}})
+    state = testing.State(
+        leader=True,
+        containers=[container],
+        relations=[prometheus, replicas],
+        planned_units=2,
+        config={"probes_file": probes_file, "probe_sharding": "hashmod"},
+    )
+    state = context.run(context.on.config_changed(), state)
+
+    # WHEN a third unit joins
+    replicas = dataclasses.replace(replicas, peers_data={1: {}, 2: {}})
+    state = dataclasses.replace(state, planned_units=3, relations=[prometheus, replicas])
+    state_out = context.run(context.on.relation_joined(replicas, remote_unit=2), state)
+
+    # THEN there is one job per unit, all hashing the targets modulo three
+    jobs = json.loads(state_out.get_relation(prometheus.id).local_app_data["scrape_jobs"])
+    probe_jobs = [job for job in jobs if "relabel_configs" in job]
+    assert len(probe_jobs) == 3
+    for job in probe_jobs:
+        steps = job["relabel_configs"]
+        (hashmod,) = [step for step in steps if step.get("action") == "hashmod"]
+        assert hashmod["modulus"] == 3
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_invalid_sharding_mode_blocks(context, container):
+    # GIVEN an unknown probe_sharding mode
+    state = testing.State(
+        leader=True, containers=[container], config={"probe_sharding": "round-robin"}
+    )
+    # WHEN the config is applied
+    state_out = context.run(context.on.config_changed(), state)
+    # THEN the charm is blocked
+    assert isinstance(state_out.unit_status, testing.BlockedStatus)
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_conflicting_probes_modules_block(context, container):
+    # GIVEN two probes relations defining the same module differently
+    relations = [
+        testing.Relation(
+            "probes",
+            remote_app_name=app,
+            remote_app_data={
+                "scrape_metadata": json.dumps(
+                    {
+                        "model": "probes-model",
+                        "model_uuid": "12de4fae-06cc-4ceb-9089-567be09fec78",
+                        "application": app,
+                        "charm_name": "probes-charm",
+                        "unit": f"{app}/0",
+                    }
+                ),
+                "scrape_probes": json.dumps([]),
+                "scrape_modules": json.dumps({"slow": {"prober": "http", "timeout": timeout}}),
+            },
+        )
+        for app, timeout in (("first", "30s"), ("second", "10s"))
+    ]
+    state = testing.State(leader=True, containers=[container], relations=relations)
+
+    # WHEN the charm reconciles, and again with unchanged inputs
+    state = context.run(context.on.config_changed(), state)
+    state_out = context.run(context.on.update_status(), state)
+
+    # THEN the conflict is shown in the unit status both times
+    for status in (state.unit_status, state_out.unit_status):
+        assert isinstance(status, testing.BlockedStatus)
+        assert "Conflicting blackbox module(s) slow" in status.message
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_scrape_jobs_are_not_computed_when_not_needed(context, container):
+    # GIVEN a charm not related to Prometheus
+    state = testing.State(leader=True, containers=[container])
+    # WHEN the workload is reconciled
+    with patch.object(ScrapeConfigBuilder, "build_probes") as build:
+        context.run(context.on.config_changed(), state)
+    # THEN the probes scraping jobs are never built
+    build.assert_not_called()
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_scrape_jobs_are_computed_once_per_dispatch(context, container):
+    # GIVEN a charm related to two Prometheus applications
+    relations = [
+        testing.Relation("self-metrics-endpoint", remote_app_name=f"prometheus{i}")
+        for i in range(2)
+    ]
+    probes_file = yaml.safe_dump(
+        {"scrape_configs": [{"job_name": "file_job", "static_configs": [{"targets": ["a"]}]}]}
+    )
+    state = testing.State(
+        leader=True,
+        containers=[container],
+        relations=relations,
+        config={"probes_file": probes_file},
+    )
+    # WHEN the scrape jobs are published
+    with patch.object(
+        ScrapeConfigBuilder,
+        "build_probes",
+        autospec=True,
+        side_effect=ScrapeConfigBuilder.build_probes,
+    ) as build:
+        state_out = context.run(context.on.update_status(), state)
+    # THEN they are built once and published to every relation
+    build.assert_called_once()
+    for relation in relations:
+        jobs = json.loads(state_out.get_relation(relation.id).local_app_data["scrape_jobs"])
+        assert [job["job_name"] for job in jobs if "job_name" in job] == ["file_job"]
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_invalid_scrape_tiers_block(context, container):
+    # GIVEN scrape tiers that are not a mapping
+    state = testing.State(leader=True, containers=[container], config={"scrape_tiers": "[icmp]"})
+    # WHEN the workload is reconciled
+    state_out = context.run(context.on.config_changed(), state)
+    # THEN the unit is blocked
+    assert isinstance(state_out.unit_status, testing.BlockedStatus)
+    assert "scrape_tiers" in state_out.unit_status.message
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_scrape_tiers_use_the_rendered_modules(context, container):
+    # GIVEN a config file with a slow icmp module and a tier for the icmp prober
+    config_file = yaml.safe_dump({"modules": {"ping": {"prober": "icmp", "timeout": "15s"}}})
+    probes_file = yaml.safe_dump(
+        {
+            "scrape_configs": [
+                {
+                    "job_name": "file_job",
+                    "params": {"module": ["ping"]},
+                    "static_configs": [{"targets": ["10.0.0.1"]}],
+                }
+            ]
+        }
+    )
+    state = testing.State(
+        leader=True,
+        containers=[container],
+        config={
+            "config_file": config_file,
+            "probes_file": probes_file,
+            "scrape_tiers": "{icmp: {scrape_interval: 1m, scrape_timeout: 10s}}",
+        },
+    )
+    # WHEN the probes scraping jobs are built
+    with context(context.on.update_status(), state) as mgr:
+        (job,) = mgr.charm.probes_scraping_jobs
+    # THEN the job gets the icmp tier, with a timeout longer than the module's
+    assert job["scrape_interval"] == "1m"
+    assert job["scrape_timeout"] == "16s"
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_resource_requests_follow_the_probes(context, container):
+    # GIVEN requests sized after a probes file of 3000 http targets
+    probes_file = yaml.safe_dump(
+        {
+            "scrape_configs": [
+                {
+                    "job_name": "file_job",
+                    "params": {"module": ["http_2xx"]},
+                    "static_configs": [{"targets": [f"10.0.0.{i}" for i in range(3000)]}],
+                }
+            ]
+        }
+    )
+    state = testing.State(
+        leader=True,
+        containers=[container],
+        config={"probes_file": probes_file, "resource_sizing": "requests-and-limits"},
+    )
+    # WHEN the resource requirements are computed
+    with context(context.on.update_status(), state) as mgr:
+        resource_reqs = mgr.charm._resource_reqs_from_config()
+    # THEN the requests are estimated, and the limits derived from them
+    assert resource_reqs.requests == {"cpu": "250m", "memory": "320Mi"}
+    assert resource_reqs.limits == {"cpu": "0.5", "memory": str(640 * 2**20)}
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_resource_requests_changes_are_damped(context, container):
+    # GIVEN a StatefulSet with requests sized for a slightly smaller fleet
+    state = testing.State(
+        leader=False, containers=[container], config={"resource_sizing": "requests"}
+    )
+    applied = ResourceRequirements(requests={"cpu": "60m", "memory": "70Mi"})
+    # WHEN a unit, whatever it remembers, computes the resource requirements
+    with (
+        patch.object(ResourcePatcher, "get_templated", return_value=applied),
+        context(context.on.update_status(), state) as mgr,
+    ):
+        resource_reqs = mgr.charm._resource_reqs_from_config()
+    # THEN the requests of the StatefulSet are kept
+    assert resource_reqs.requests == {"cpu": "60m", "memory": "70Mi"}
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_resource_requests_are_sized_once_per_dispatch(context, container):
+    # GIVEN requests sized after the probes, with unchanged inputs
+    prometheus = testing.Relation("self-metrics-endpoint", remote_app_name="prometheus")
+    state = testing.State(
+        leader=True,
+        containers=[container],
+        relations=[prometheus],
+        config={"resource_sizing": "requests"},
+    )
+    state = context.run(context.on.config_changed(), state)
+    # WHEN update-status fires
+    with (
+        patch.object(
+            ScrapeConfigBuilder,
+            "build_probes",
+            autospec=True,
+            side_effect=ScrapeConfigBuilder.build_probes,
+        ) as build,
+        patch.object(ResourcePatcher, "get_templated", return_value=None) as get_templated,
+    ):
+        context.run(context.on.update_status(), state)
+    # THEN the probes are built, and the StatefulSet read, only once for both the
+    # resources and the scrape jobs
+    build.assert_called_once()
+    get_templated.assert_called_once()
+
+
+@pytest.mark.parametrize("resource_sizing, patches", (("static", 0), ("requests", 1)))
+@pytest.mark.usefixtures("patch_all")
+def test_probes_changes_patch_only_sized_resources(
+    context, container, resource_sizing, patches
+):
+    # GIVEN a probes relation
+    probes = testing.Relation("probes", remote_app_name="provider")
+    state = testing.State(
+        leader=True,
+        containers=[container],
+        relations=[probes],
+        config={"resource_sizing": resource_sizing},
+    )
+    # WHEN the probes change
+    with patch.object(KubernetesComputeResourcesPatch, "_patch") as patch_resources:
+        context.run(context.on.relation_changed(probes), state)
+    # THEN the resources are only patched again if they follow the probes
+    assert patch_resources.call_count == patches
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_invalid_resource_sizing_blocks(context, container):
+    # GIVEN an unknown resource sizing mode
+    state = testing.State(
+        leader=True, containers=[container], config={"resource_sizing": "dynamic"}
+    )
+    # WHEN the workload is reconciled
+    state_out = context.run(context.on.config_changed(), state)
+    # THEN the unit is blocked
+    assert isinstance(state_out.unit_status, testing.BlockedStatus)
+    assert "resource_sizing" in state_out.unit_status.message
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_resources_patch_readiness_is_remembered(context, container):
+    # GIVEN a pod whose resources patch is in effect
+    state = testing.State(leader=True, containers=[container])
+    with (
+        patch("charm._pod_incarnation", return_value="pod-a"),
+        patch("charm.KubernetesComputeResourcesPatch.is_ready", return_value=True) as is_ready,
+    ):
+        state = context.run(context.on.update_status(), state)
+        # WHEN another hook runs on the same pod, with the same resource requirements
+        state = context.run(context.on.update_status(), state)
+        # THEN K8s is only asked once
+        assert is_ready.call_count == 1
+
+        # AND WHEN the resource requirements change
+        state = dataclasses.replace(state, config={"memory": "1Gi"})
+        state = context.run(context.on.config_changed(), state)
+        # THEN K8s is asked again
+        assert is_ready.call_count == 2
+
+    # AND WHEN the pod is replaced
+    with (
+        patch("charm._pod_incarnation", return_value="pod-b"),
+        patch("charm.KubernetesComputeResourcesPatch.is_ready", return_value=True) as is_ready,
+    ):
+        context.run(context.on.update_status(), state)
+    # THEN K8s is asked again
+    assert is_ready.call_count == 1
+
+
+@pytest.mark.usefixtures("patch_all")
+def test_resources_patch_not_ready_is_rechecked(context, container):
+    # GIVEN a resources patch that is not in effect yet
+    state = testing.State(leader=True, containers=[container])
+    with (
+        patch("charm._pod_incarnation", return_value="pod-a"),
+        patch("charm.KubernetesComputeResourcesPatch.is_ready", return_value=False) as is_ready,
+    ):
+        state = context.run(context.on.update_status(), state)
+        # WHEN another hook runs
+        state = context.run(context.on.update_status(), state)
+    # THEN K8s is asked every time, and the unit keeps waiting
+    assert is_ready.call_count == 2
+    assert isinstance(state.unit_status, testing.WaitingStatus)
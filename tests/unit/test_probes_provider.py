@@ -4,14 +4,16 @@
 import json
 import unittest
 from typing import List
+from unittest.mock import patch
 
 from charms.blackbox_exporter_k8s.v0.blackbox_probes import BlackboxProbesProvider
-from cosl import JujuTopology
+from cosl import JujuTopology, LZMABase64
 from ops.charm import CharmBase
 from ops.framework import StoredState
 from ops.model import (
     ActiveStatus,
     BlockedStatus,
+    RelationDataContent,
 )
 from ops.testing import Harness
 
@@ -171,6 +173,52 @@ class BlackboxProbesProviderTest(unittest.TestCase):
         expected_key = f"{module_name_prefix}http_2xx_longer_timeout"
         self.assertEqual(actual_key, expected_key)
 
+    def test_provider_skips_unchanged_databag(self):
+        # GIVEN a relation whose probes specification is already set
+        rel_id = self.harness.add_relation(RELATION_NAME, "provider")
+        self.harness.add_relation_unit(rel_id, "provider/0")
+        self.harness.charm.provider._set_probes_spec()
+
+        # WHEN the provider sets the same specification again
+        with (
+            patch.object(RelationDataContent, "__setitem__") as set_item,
+            patch.object(RelationDataContent, "__delitem__") as del_item,
+        ):
+            self.harness.charm.provider._set_probes_spec()
+
+        # THEN nothing is written to the relation
+        set_item.assert_not_called()
+        del_item.assert_not_called()
+
+    def test_provider_only_writes_changed_keys(self):
+        # GIVEN a relation whose probes specification is already set
+        rel_id = self.harness.add_relation(RELATION_NAME, "provider")
+        self.harness.add_relation_unit(rel_id, "provider/0")
+        self.harness.charm.provider._set_probes_spec()
+
+        # WHEN the probes change, and a stale key is found in the databag
+        self.harness.charm.provider._probes[0]["static_configs"][0]["targets"] = ["10.1.238.2"]
+        with self.harness.hooks_disabled():
+            self.harness.update_relation_data(
+                rel_id, self.harness.model.app.name, {"stale": "value"}
+            )
+        with patch.object(
+            RelationDataContent,
+            "__setitem__",
+            autospec=True,
+            side_effect=RelationDataContent.__setitem__,
+        ) as set_item:
+            self.harness.charm.provider._set_probes_spec()
+        data_after = self.harness.get_relation_data(rel_id, self.harness.model.app.name)
+
+        # THEN only the probes are written, and the stale key is removed (set to "" by ops)
+        self.assertEqual(
+            [call.args[1:] for call in set_item.call_args_list if call.args[2]],
+            [("scrape_probes", data_after["scrape_probes"])],
+        )
+        self.assertNotIn("stale", data_after)
+        self.assertIn("10.1.238.2", data_after["scrape_probes"])
+
     def test_get_active_status(self):
         self.addCleanup(self.harness.cleanup)
 
@@ -218,3 +266,52 @@ class BlackboxProbesWrongProviderTest(unittest.TestCase):
         # THEN the status of the charm is set to Blocked
         status = self.harness.charm.provider.get_status()
         assert status == BlockedStatus("Errors occurred in probe configuration")
+
+
+class BlackboxProbesProviderCharmWithCompression(CharmBase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args)
+
+        self.provider = BlackboxProbesProvider(
+            self, probes=PROBES, modules=MODULES, compression=True, chunk_size=64
+        )
+
+
+class BlackboxProbesCompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(BlackboxProbesProviderCharmWithCompression, meta=PROVIDER_META)
+        self.harness.set_model_name("MyUUID")
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.begin_with_initial_hooks()
+        self.rel_id = self.harness.add_relation(RELATION_NAME, "blackbox")
+        self.harness.add_relation_unit(self.rel_id, "blackbox/0")
+
+    def test_plain_probes_for_requirers_without_v1_support(self):
+        # GIVEN a requirer that does not advertise the formats it supports
+        # WHEN the provider sets the probe specification
+        self.harness.charm.provider._set_probes_spec()
+
+        # THEN the probes are sent as plain JSON
+        data = self.harness.get_relation_data(self.rel_id, self.harness.model.app.name)
+        self.assertEqual(len(json.loads(data["scrape_probes"])), 2)
+        self.assertNotIn("probes_format", data)
+
+    def test_compressed_chunked_probes_for_requirers_with_v1_support(self):
+        # WHEN the requirer advertises support for the v1 format
+        self.harness.update_relation_data(
+            self.rel_id, "blackbox", {"supported_probes_formats": json.dumps(["v0", "v1"])}
+        )
+
+        # THEN the probes are sent compressed, in chunks of at most 64 characters
+        data = self.harness.get_relation_data(self.rel_id, self.harness.model.app.name)
+        self.assertNotIn("scrape_probes", data)
+        self.assertEqual(data["probes_format"], "v1")
+        chunks = [data[f"scrape_probes_{i}"] for i in range(int(data["scrape_probes_chunks"]))]
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 64 for chunk in chunks))
+        probes = json.loads(LZMABase64.decompress("".join(chunks)))
+        self.assertEqual(probes[0]["static_configs"][0]["targets"], ["10.1.238.1"])
+        # AND the metadata and modules are unchanged
+        self.assertIn("scrape_metadata", data)
+        self.assertEqual(len(json.loads(data["scrape_modules"])), 1)
@@ -2,12 +2,21 @@
 # See LICENSE file for licensing details.
 
 import json
+import tempfile
 import unittest
-from typing import List
-
-from charms.blackbox_exporter_k8s.v0.blackbox_probes import BlackboxProbesRequirer
+from pathlib import Path
+from typing import List, Optional
+from unittest.mock import patch
+
+from charms.blackbox_exporter_k8s.v0.blackbox_probes import (
+    PAYLOAD_FILE_PREFIX,
+    ApplicationDataModel,
+    BlackboxProbesRequirer,
+)
+from cosl import LZMABase64
 from ops.charm import CharmBase
 from ops.framework import StoredState
+from ops.model import BlockedStatus
 from ops.testing import Harness
 
 RELATION_NAME = "probes"
@@ -106,11 +115,14 @@ IDENTICAL_PROBES: List[dict] = [
 
 class BlackboxProbesRequirerCharm(CharmBase):
     _stored = StoredState()
+    cache_dir: Optional[Path] = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args)
         self._stored.set_default(num_events=0)
-        self.probes_requirer = BlackboxProbesRequirer(self, RELATION_NAME)
+        self.probes_requirer = BlackboxProbesRequirer(
+            self, RELATION_NAME, cache_dir=self.cache_dir
+        )
         self.framework.observe(self.probes_requirer.on.targets_changed, self.record_events)
 
     def record_events(self, event):
@@ -123,6 +135,13 @@ class BlackboxProbesRequirerCharm(CharmBase):
 
 class BlackboxProbesRequirerTest(unittest.TestCase):
     def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = Path(cache_dir.name)
+        cache_dir_patch = patch.object(BlackboxProbesRequirerCharm, "cache_dir", self.cache_dir)
+        cache_dir_patch.start()
+        self.addCleanup(cache_dir_patch.stop)
+
         self.harness = Harness(BlackboxProbesRequirerCharm, meta=REQUIRER_META)
 
         self.addCleanup(self.harness.cleanup)
@@ -295,3 +314,407 @@ class BlackboxProbesRequirerTest(unittest.TestCase):
         # THEN all the probes in all the relations are returned in a list
         self.assertEqual(len(probes), 4)
         self.assertEqual(type(probes), list)
+
+    def test_only_changed_relation_is_parsed_again(self):
+        # GIVEN two relations whose probes were already fetched
+        first_rel_id = self.harness.add_relation(RELATION_NAME, "first_requirer")
+        second_rel_id = self.harness.add_relation(RELATION_NAME, "second_requirer")
+        for rel_id, app in ((first_rel_id, "first_requirer"), (second_rel_id, "second_requirer")):
+            self.harness.update_relation_data(
+                rel_id,
+                app,
+                {
+                    "scrape_metadata": json.dumps(SCRAPE_METADATA),
+                    "scrape_probes": json.dumps(PROBES),
+                    "scrape_modules": json.dumps(MODULES),
+                },
+            )
+        self.harness.charm.probes_requirer.probes()
+
+        # WHEN only one of the relations changes
+        self.harness.update_relation_data(
+            second_rel_id, "second_requirer", {"scrape_probes": json.dumps(PROBES[:1])}
+        )
+        with patch.object(
+            ApplicationDataModel, "load", wraps=ApplicationDataModel.load
+        ) as load:
+            probes = self.harness.charm.probes_requirer.probes()
+
+        # THEN only that relation's databag is validated again
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(len(probes), 3)
+
+    def test_unchanged_probes_are_not_parsed_again(self):
+        # GIVEN a relation whose probes were already fetched
+        self.setup_charm_relations()
+        self.harness.charm.probes_requirer.probes()
+
+        # WHEN the probes are fetched again
+        with patch.object(
+            ApplicationDataModel, "load", wraps=ApplicationDataModel.load
+        ) as load:
+            probes = self.harness.charm.probes_requirer.probes()
+
+        # THEN the cached probes are returned
+        load.assert_not_called()
+        self.assertEqual(len(probes), 2)
+        self.assertIsInstance(probes[0], dict)
+
+    def test_removed_relation_probes_are_dropped(self):
+        # GIVEN a relation whose probes were already fetched
+        rel_id = self.harness.add_relation(RELATION_NAME, "requirer")
+        self.harness.update_relation_data(
+            rel_id,
+            "requirer",
+            {
+                "scrape_metadata": json.dumps(SCRAPE_METADATA),
+                "scrape_probes": json.dumps(PROBES),
+                "scrape_modules": json.dumps(MODULES),
+            },
+        )
+        self.assertEqual(len(self.harness.charm.probes_requirer.probes()), 2)
+
+        # WHEN the relation is removed
+        self.harness.remove_relation(rel_id)
+
+        # THEN its probes are gone
+        self.assertEqual(self.harness.charm.probes_requirer.probes(), [])
+
+    def test_modules_are_merged_across_relations(self):
+        # GIVEN two relations providing different modules
+        for app, modules in (
+            ("first_requirer", MODULES),
+            ("second_requirer", {"icmp_ttl3": {"prober": "icmp", "icmp": {"ttl": 3}}}),
+        ):
+            rel_id = self.harness.add_relation(RELATION_NAME, app)
+            self.harness.update_relation_data(
+                rel_id,
+                app,
+                {
+                    "scrape_metadata": json.dumps(SCRAPE_METADATA),
+                    "scrape_probes": json.dumps(PROBES),
+                    "scrape_modules": json.dumps(modules),
+                },
+            )
+
+        # WHEN the modules are retrieved from the requirer
+        modules = self.harness.charm.probes_requirer.modules()
+
+        # THEN the modules of both relations are returned
+        self.assertEqual(set(modules), {"http_2xx_longer_timeout", "icmp_ttl3"})
+
+    def test_conflicting_modules_are_reported(self):
+        # GIVEN two relations defining the same module differently
+        for app, timeout in (("first_requirer", "30s"), ("second_requirer", "10s")):
+            rel_id = self.harness.add_relation(RELATION_NAME, app)
+            self.harness.update_relation_data(
+                rel_id,
+                app,
+                {
+                    "scrape_metadata": json.dumps(SCRAPE_METADATA),
+                    "scrape_probes": json.dumps(PROBES),
+                    "scrape_modules": json.dumps(
+                        {"http_2xx_longer_timeout": {"prober": "http", "timeout": timeout}}
+                    ),
+                },
+            )
+
+        # WHEN the modules are retrieved from the requirer
+        modules = self.harness.charm.probes_requirer.modules()
+
+        # THEN the first definition is kept and the conflict is reported
+        self.assertEqual(modules["http_2xx_longer_timeout"]["timeout"], "30s")
+        status = self.harness.charm.probes_requirer.get_status()
+        self.assertIsInstance(status, BlockedStatus)
+        self.assertIn("Conflicting blackbox module(s) http_2xx_longer_timeout", status.message)
+
+    def test_invalid_probes_are_reported_briefly(self):
+        # GIVEN a relation with many probes, missing its scrape metadata
+        targets = [f"10.0.{i}.1" for i in range(200)]
+        probes = [{**PROBES[0], "static_configs": [{"targets": targets}]}]
+        rel_id = self.harness.add_relation(RELATION_NAME, "requirer")
+        self.harness.update_relation_data(
+            rel_id, "requirer", {"scrape_probes": json.dumps(probes * 10)}
+        )
+
+        # WHEN the probes are retrieved from the requirer
+        self.harness.charm.probes_requirer.probes()
+
+        # THEN the relation is reported, without the contents of its databag
+        status = self.harness.charm.probes_requirer.get_status()
+        self.assertIsInstance(status, BlockedStatus)
+        self.assertIn(f"Invalid probes in relation(s) {rel_id}", status.message)
+        self.assertLess(len(status.message), 200)
+        for entry in self.harness.charm.probes_requirer._stored.relation_cache.values():
+            self.assertNotIn("10.0.", entry["error"])
+
+    def test_conflicting_modules_are_logged_once(self):
+        # GIVEN two relations defining the same module differently
+        for app, timeout in (("first_requirer", "30s"), ("second_requirer", "10s")):
+            rel_id = self.harness.add_relation(RELATION_NAME, app)
+            self.harness.update_relation_data(
+                rel_id,
+                app,
+                {
+                    "scrape_metadata": json.dumps(SCRAPE_METADATA),
+                    "scrape_probes": json.dumps(PROBES),
+                    "scrape_modules": json.dumps(
+                        {"http_2xx_longer_timeout": {"prober": "http", "timeout": timeout}}
+                    ),
+                },
+            )
+
+        # WHEN the probes and modules are retrieved several times
+        with self.assertLogs(level="WARNING") as logs:
+            for _ in range(3):
+                self.harness.charm.probes_requirer.probes()
+                self.harness.charm.probes_requirer.modules()
+
+        # THEN the conflict is logged only once
+        conflicts = [line for line in logs.output if "Conflicting" in line]
+        self.assertEqual(len(conflicts), 1)
+
+    def test_equivalent_probes_get_the_same_job_name(self):
+        # GIVEN two probes differing only in key order, target order and unset fields
+        probe = {
+            "job_name": "my-job",
+            "params": {"module": ["http_2xx"]},
+            "static_configs": [{"targets": ["10.1.238.1", "10.1.238.2"]}],
+        }
+        equivalent_probe = {
+            "static_configs": [{"labels": None, "targets": ["10.1.238.2", "10.1.238.1"]}],
+            "metrics_path": None,
+            "params": {"module": ["http_2xx"]},
+            "job_name": "my-job",
+        }
+        rel_id = self.harness.add_relation(RELATION_NAME, "requirer")
+        self.harness.update_relation_data(
+            rel_id,
+            "requirer",
+            {
+                "scrape_metadata": json.dumps(SCRAPE_METADATA),
+                "scrape_probes": json.dumps([probe, equivalent_probe]),
+                "scrape_modules": json.dumps(MODULES),
+            },
+        )
+
+        # WHEN the probes are retrieved from the requirer
+        probes = self.harness.charm.probes_requirer.probes()
+
+        # THEN they are deduplicated into a single job
+        self.assertEqual(len(probes), 1)
+        self.assertTrue(probes[0]["job_name"].startswith("my-job_"))
+
+    def test_unchanged_probes_are_not_hashed_again(self):
+        # GIVEN a relation whose probes were already fetched
+        self.setup_charm_relations()
+        self.harness.charm.probes_requirer.probes()
+
+        # WHEN the provider changes its modules but not its probes
+        rel_id = self.harness.model.relations[RELATION_NAME][0].id
+        self.harness.update_relation_data(
+            rel_id, "requirer", {"scrape_modules": json.dumps({"icmp_v6": {"prober": "icmp"}})}
+        )
+        with patch.object(
+            BlackboxProbesRequirer,
+            "_process_and_hash_probes",
+            wraps=self.harness.charm.probes_requirer._process_and_hash_probes,
+        ) as process:
+            probes = self.harness.charm.probes_requirer.probes()
+            modules = self.harness.charm.probes_requirer.modules()
+
+        # THEN the new modules are returned without hashing the probes again
+        process.assert_not_called()
+        self.assertEqual(len(probes), 2)
+        self.assertEqual(list(modules), ["icmp_v6"])
+
+    def test_stored_state_only_keeps_digests(self):
+        # GIVEN a relation with probes and modules
+        self.setup_charm_relations()
+
+        # WHEN the probes are fetched
+        self.harness.charm.probes_requirer.probes()
+
+        # THEN the stored state only references them by digest, and they are kept on disk
+        (entry,) = self.harness.charm.probes_requirer._stored.relation_cache.values()
+        self.assertEqual(
+            set(entry.keys()),
+            {"digest", "probes_digest", "probes_payload", "modules_payload", "error"},
+        )
+        probes_path = self.cache_dir / f"{PAYLOAD_FILE_PREFIX}{entry['probes_payload']}.json"
+        modules_path = self.cache_dir / f"{PAYLOAD_FILE_PREFIX}{entry['modules_payload']}.json"
+        self.assertEqual(len(json.loads(probes_path.read_text())), 2)
+        self.assertEqual(list(json.loads(modules_path.read_text())), list(MODULES))
+
+    def test_modules_are_read_without_the_probes(self):
+        # GIVEN a relation whose probes were already fetched in a previous hook
+        self.setup_charm_relations()
+        self.harness.charm.probes_requirer.probes()
+        self.harness.charm.probes_requirer._payloads.clear()
+
+        # WHEN only the modules are fetched
+        with patch.object(
+            BlackboxProbesRequirer,
+            "_read_payload",
+            wraps=self.harness.charm.probes_requirer._read_payload,
+        ) as read_payload:
+            modules = self.harness.charm.probes_requirer.modules()
+
+        # THEN the cached probes are not read
+        (entry,) = self.harness.charm.probes_requirer._stored.relation_cache.values()
+        read_payload.assert_called_once_with(entry["modules_payload"])
+        self.assertEqual(list(modules), list(MODULES))
+
+    def test_missing_payload_is_parsed_again(self):
+        # GIVEN a relation whose probes were already fetched
+        self.setup_charm_relations()
+        self.harness.charm.probes_requirer.probes()
+
+        # WHEN the cached payloads are lost, e.g. because the pod was rescheduled
+        for path in self.cache_dir.iterdir():
+            path.unlink()
+        self.harness.charm.probes_requirer._payloads.clear()
+        with patch.object(
+            ApplicationDataModel, "load", wraps=ApplicationDataModel.load
+        ) as load:
+            probes = self.harness.charm.probes_requirer.probes()
+
+        # THEN the relation is parsed again
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(len(probes), 2)
+        self.assertEqual(len(list(self.cache_dir.glob(f"{PAYLOAD_FILE_PREFIX}*.json"))), 2)
+
+    def test_removed_relation_payload_is_deleted(self):
+        # GIVEN a relation whose probes were already fetched
+        rel_id = self.harness.add_relation(RELATION_NAME, "requirer")
+        self.harness.update_relation_data(
+            rel_id,
+            "requirer",
+            {
+                "scrape_metadata": json.dumps(SCRAPE_METADATA),
+                "scrape_probes": json.dumps(PROBES),
+                "scrape_modules": json.dumps(MODULES),
+            },
+        )
+        self.harness.charm.probes_requirer.probes()
+        # AND another file in the cache directory
+        other_file = self.cache_dir / "other.json"
+        other_file.write_text("{}")
+
+        # WHEN the relation is removed
+        self.harness.remove_relation(rel_id)
+
+        # THEN its cached payload is deleted, but not the other file
+        self.assertEqual(list(self.cache_dir.glob(f"{PAYLOAD_FILE_PREFIX}*.json")), [])
+        self.assertTrue(other_file.exists())
+
+    def test_legacy_stored_keys_are_dropped(self):
+        # GIVEN the stored state of an older version of the library, holding the probes
+        harness = Harness(BlackboxProbesRequirerCharm, meta=REQUIRER_META)
+        self.addCleanup(harness.cleanup)
+        handle = (
+            "BlackboxProbesRequirerCharm/BlackboxProbesRequirer[probes]/StoredStateData[_stored]"
+        )
+        harness.framework._storage.save_snapshot(
+            handle,
+            {
+                "scrape_probes": PROBES,
+                "blackbox_scrape_modules": MODULES,
+                "errors": [],
+                "probes_need_update": False,
+                "modules_need_update": False,
+            },
+        )
+
+        # WHEN the charm starts with the new version of the library
+        harness.begin()
+        harness.framework.commit()
+
+        # THEN the keys of the older version are no longer stored
+        stored = harness.framework._storage.load_snapshot(handle)
+        self.assertEqual(set(stored.keys()), {"relation_cache", "relations_need_update", "errors"})
+
+    def test_returned_probes_are_copies(self):
+        # GIVEN a relation whose probes were already fetched
+        self.setup_charm_relations()
+        probes = self.harness.charm.probes_requirer.probes()
+
+        # WHEN the caller changes them
+        probes[0]["relabel_configs"] = []
+
+        # THEN the cached probes are not affected
+        self.assertNotIn("relabel_configs", self.harness.charm.probes_requirer.probes()[0])
+
+    def test_compressed_probes_are_decoded(self):
+        # GIVEN a provider sending its probes compressed, in two chunks
+        compressed = LZMABase64.compress(json.dumps(PROBES))
+        middle = len(compressed) // 2
+        rel_id = self.harness.add_relation(RELATION_NAME, "requirer")
+        self.harness.update_relation_data(
+            rel_id,
+            "requirer",
+            {
+                "scrape_metadata": json.dumps(SCRAPE_METADATA),
+                "scrape_modules": json.dumps(MODULES),
+                "probes_format": "v1",
+                "scrape_probes_chunks": "2",
+                "scrape_probes_0": compressed[:middle],
+                "scrape_probes_1": compressed[middle:],
+            },
+        )
+
+        # WHEN the probes are fetched
+        probes = self.harness.charm.probes_requirer.probes()
+
+        # THEN they are the same as if they were sent as plain JSON
+        self.assertEqual(len(probes), 2)
+        self.assertEqual(probes[0]["static_configs"][0]["targets"], ["10.1.238.1"])
+        self.assertEqual(list(self.harness.charm.probes_requirer.modules()), list(MODULES))
+
+    def test_corrupted_compressed_probes_are_reported(self):
+        # GIVEN a provider sending a truncated compressed payload
+        compressed = LZMABase64.compress(json.dumps(PROBES))
+        rel_id = self.harness.add_relation(RELATION_NAME, "requirer")
+        self.harness.update_relation_data(
+            rel_id,
+            "requirer",
+            {
+                "scrape_metadata": json.dumps(SCRAPE_METADATA),
+                "probes_format": "v1",
+                "scrape_probes_chunks": "1",
+                "scrape_probes_0": compressed[:-8],
+            },
+        )
+
+        # WHEN the probes are fetched
+        probes = self.harness.charm.probes_requirer.probes()
+
+        # THEN none are returned and the error is reported
+        self.assertEqual(probes, [])
+        self.assertIsInstance(self.harness.charm.probes_requirer.get_status(), BlockedStatus)
+
+    def test_leader_advertises_supported_formats_on_upgrade(self):
+        # GIVEN a leader unit related to a probes provider, without any advertised formats
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation(RELATION_NAME, "provider")
+        data = self.harness.get_relation_data(rel_id, self.harness.model.app.name)
+        self.assertNotIn("supported_probes_formats", data)
+
+        # WHEN the charm is upgraded
+        self.harness.charm.on.upgrade_charm.emit()
+
+        # THEN the requirer advertises the wire formats it supports
+        data = self.harness.get_relation_data(rel_id, self.harness.model.app.name)
+        self.assertEqual(json.loads(data["supported_probes_formats"]), ["v0", "v1"])
+
+    def test_leader_advertises_supported_formats(self):
+        # GIVEN a leader unit
+        self.harness.set_leader(True)
+
+        # WHEN a probes provider joins
+        rel_id = self.harness.add_relation(RELATION_NAME, "provider")
+        self.harness.add_relation_unit(rel_id, "provider/0")
+
+        # THEN the requirer advertises the wire formats it supports
+        data = self.harness.get_relation_data(rel_id, self.harness.model.app.name)
+        self.assertEqual(json.loads(data["supported_probes_formats"]), ["v0", "v1"])
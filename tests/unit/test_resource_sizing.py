@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+
+from resource_sizing import apply_hysteresis, estimate_resource_requests, limits_from_requests
+
+MODULES = {"http_2xx": {"prober": "http"}, "ping": {"prober": "icmp"}}
+
+
+def _job(module, targets, **kwargs):
+    return {
+        "job_name": f"{module}_job",
+        "params": {"module": [module]},
+        "static_configs": [{"targets": [f"t{i}" for i in range(targets)]}],
+        **kwargs,
+    }
+
+
+class TestEstimateResourceRequests(unittest.TestCase):
+    def test_no_probes_request_the_base_footprint(self):
+        self.assertEqual(
+            estimate_resource_requests([], MODULES), {"cpu": "50m", "memory": "64Mi"}
+        )
+
+    def test_requests_grow_with_the_probe_rate(self):
+        # GIVEN the same http targets, scraped every minute or every 10 seconds
+        slow = estimate_resource_requests([_job("http_2xx", 3000)], MODULES)
+        fast = estimate_resource_requests(
+            [_job("http_2xx", 3000, scrape_interval="10s")], MODULES
+        )
+        # THEN scraping them faster costs more cpu and memory
+        self.assertEqual(slow, {"cpu": "250m", "memory": "320Mi"})
+        self.assertEqual(fast, {"cpu": "1250m", "memory": "1568Mi"})
+
+    def test_cheap_probers_request_less(self):
+        # GIVEN as many icmp targets as http ones
+        http = estimate_resource_requests([_job("http_2xx", 3000)], MODULES)
+        icmp = estimate_resource_requests([_job("ping", 3000)], MODULES)
+        # THEN icmp probes request less
+        self.assertEqual(icmp, {"cpu": "100m", "memory": "96Mi"})
+        self.assertLess(int(icmp["cpu"][:-1]), int(http["cpu"][:-1]))
+
+    def test_shards_split_the_load(self):
+        jobs = [_job("http_2xx", 3000, scrape_interval="10s")]
+        self.assertEqual(
+            estimate_resource_requests(jobs, MODULES, shards=4),
+            {"cpu": "350m", "memory": "448Mi"},
+        )
+
+
+class TestHysteresis(unittest.TestCase):
+    def test_small_changes_are_absorbed(self):
+        current = {"cpu": "1000m", "memory": "1000Mi"}
+        proposed = {"cpu": "1150m", "memory": "850Mi"}
+        self.assertEqual(apply_hysteresis(current, proposed), current)
+
+    def test_large_changes_are_applied(self):
+        current = {"cpu": "1000m", "memory": "1000Mi"}
+        proposed = {"cpu": "1250m", "memory": "900Mi"}
+        self.assertEqual(
+            apply_hysteresis(current, proposed), {"cpu": "1250m", "memory": "1000Mi"}
+        )
+
+    def test_first_estimate_is_applied(self):
+        proposed = {"cpu": "100m", "memory": "96Mi"}
+        self.assertEqual(apply_hysteresis({}, proposed), proposed)
+
+    def test_limits_are_twice_the_requests(self):
+        self.assertEqual(
+            limits_from_requests({"cpu": "250m", "memory": "320Mi"}),
+            {"cpu": "500m", "memory": "640Mi"},
+        )
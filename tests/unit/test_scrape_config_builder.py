@@ -2,11 +2,21 @@
 # Copyright 2024 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import copy
+import json
+import tempfile
 import unittest
+from pathlib import Path
+from unittest.mock import patch
 
 import yaml
 
-from scrape_config_builder import ScrapeConfigBuilder
+from scrape_config_builder import (
+    ScrapeConfigBuilder,
+    format_duration,
+    parse_duration,
+    parse_scrape_tiers,
+)
 
 
 class TestScrapeConfigBuilder(unittest.TestCase):
@@ -45,5 +55,377 @@ class TestScrapeConfigBuilder(unittest.TestCase):
             self.assertGreater(len(job["relabel_configs"]), 0)
 
 
+class TestFileProbesCache(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_dir = Path(tmp_dir.name)
+        self.builder = ScrapeConfigBuilder(
+            "http://blackbox-exporter:9115", cache_dir=self.cache_dir
+        )
+        self.file_probes = yaml.safe_dump(
+            {"scrape_configs": [{"job_name": "job", "static_configs": [{"targets": ["a"]}]}]}
+        )
+
+    def test_unchanged_file_probes_are_not_parsed_again(self):
+        # GIVEN the probes file was already parsed once
+        expected = self.builder.load_file_probes(self.file_probes)
+
+        # WHEN it is loaded again, unchanged
+        with patch("scrape_config_builder.yaml_codec.safe_load") as load:
+            parsed = self.builder.load_file_probes(self.file_probes)
+
+        # THEN the cached result is used
+        load.assert_not_called()
+        self.assertEqual(parsed, expected)
+
+    def test_changed_file_probes_replace_the_cache(self):
+        # GIVEN the probes file was already parsed once
+        self.builder.load_file_probes(self.file_probes)
+
+        # WHEN it changes
+        changed = yaml.safe_dump({"scrape_configs": []})
+        parsed = self.builder.load_file_probes(changed)
+
+        # THEN the new contents are parsed and only their cache is kept
+        self.assertEqual(parsed, {"scrape_configs": []})
+        self.assertEqual(len(list(self.cache_dir.glob("probes_file-*.json"))), 1)
+
+
+class TestProbeSharding(unittest.TestCase):
+    def setUp(self):
+        self.targets = [f"http://endpoint-{i}.example.com" for i in range(300)]
+        self.file_probes = yaml.safe_dump(
+            {
+                "scrape_configs": [
+                    {
+                        "job_name": "file_job",
+                        "params": {"module": ["http_2xx"]},
+                        "static_configs": [
+                            {"targets": self.targets, "labels": {"team": "observability"}}
+                        ],
+                    }
+                ]
+            }
+        )
+        self.addresses = [f"blackbox-{i}.blackbox-endpoints:9115" for i in range(3)]
+
+    def _build(self, addresses):
+        builder = ScrapeConfigBuilder("http://ingress:80/model-blackbox", addresses)
+        return builder.build_probes_scraping_jobs(file_probes=self.file_probes, relation_probes=[])
+
+    def _assignments(self, jobs):
+        return {
+            target: job["relabel_configs"][-1]["replacement"]
+            for job in jobs
+            for static_config in job["static_configs"]
+            for target in static_config["targets"]
+        }
+
+    def test_targets_are_partitioned_across_units(self):
+        # WHEN the probes are built with three shards
+        jobs = self._build(self.addresses)
+
+        # THEN each unit gets its own job, scraped directly on the unit's address
+        self.assertEqual(
+            [job["job_name"] for job in jobs], [f"file_job_shard{i}" for i in range(3)]
+        )
+        for job, address in zip(jobs, self.addresses):
+            self.assertEqual(job["metrics_path"], "/probe")
+            self.assertEqual(job["relabel_configs"][-1]["replacement"], address)
+            self.assertEqual(job["static_configs"][0]["labels"], {"team": "observability"})
+
+        # AND every target is probed exactly once
+        probed = [t for job in jobs for sc in job["static_configs"] for t in sc["targets"]]
+        self.assertCountEqual(probed, self.targets)
+
+    def test_adding_a_unit_only_moves_targets_to_it(self):
+        # GIVEN the targets partitioned across three shards
+        before = self._assignments(self._build(self.addresses))
+
+        # WHEN a fourth unit is added
+        new_address = "blackbox-3.blackbox-endpoints:9115"
+        after = self._assignments(self._build(self.addresses + [new_address]))
+
+        # THEN the only targets that moved went to the new unit
+        moved = {target for target in self.targets if before[target] != after[target]}
+        self.assertTrue(moved)
+        self.assertTrue(all(after[target] == new_address for target in moved))
+
+    def test_hashmod_keeps_targets_and_splits_with_relabeling(self):
+        # WHEN the probes are built with three hashmod shards
+        builder = ScrapeConfigBuilder(
+            "http://ingress:80/model-blackbox", self.addresses, sharding_mode="hashmod"
+        )
+        jobs = builder.build_probes_scraping_jobs(file_probes=self.file_probes, relation_probes=[])
+
+        # THEN each unit gets a copy of the job with all the targets
+        self.assertEqual(len(jobs), 3)
+        for index, (job, address) in enumerate(zip(jobs, self.addresses)):
+            self.assertEqual(job["job_name"], f"file_job_shard{index}")
+            self.assertEqual(job["static_configs"][0]["targets"], self.targets)
+            # AND only keeps the targets hashing to its own index, probed on its own address
+            relabel_configs = job["relabel_configs"]
+            self.assertEqual(relabel_configs[0]["target_label"], "__param_target")
+            self.assertEqual(relabel_configs[1]["action"], "hashmod")
+            self.assertEqual(relabel_configs[1]["modulus"], 3)
+            self.assertEqual(relabel_configs[2]["action"], "keep")
+            self.assertEqual(relabel_configs[2]["regex"], str(index))
+            self.assertEqual(relabel_configs[-1]["replacement"], address)
+
+
+class TestProbeChunking(unittest.TestCase):
+    def setUp(self):
+        self.probe = {
+            "job_name": "file_job",
+            "params": {"module": ["http_2xx"]},
+            "static_configs": [
+                {"targets": [f"a{i}" for i in range(3)], "labels": {"zone": "a"}},
+                {"targets": [f"b{i}" for i in range(4)], "labels": {"zone": "b"}},
+            ],
+        }
+
+    def _build(self, max_targets_per_job):
+        builder = ScrapeConfigBuilder(
+            "http://blackbox:9115", max_targets_per_job=max_targets_per_job
+        )
+        return builder.build_probes_scraping_jobs(
+            file_probes="", relation_probes=[copy.deepcopy(self.probe)]
+        )
+
+    @staticmethod
+    def _chunk_of(jobs):
+        """Map each (target, labels) pair to the name of the chunk it ended up in."""
+        return {
+            (target, json.dumps(static_config.get("labels"))): job["job_name"]
+            for job in jobs
+            for static_config in job["static_configs"]
+            for target in static_config["targets"]
+        }
+
+    def test_large_jobs_are_chunked(self):
+        # WHEN a job of 7 targets is built with at most 3 targets per job
+        jobs = self._build(3)
+
+        # THEN it is split into at most 3 chunks, keeping each target's labels
+        self.assertLessEqual(len(jobs), 3)
+        self.assertTrue(
+            {job["job_name"] for job in jobs} <= {f"file_job_chunk{i}" for i in range(3)}
+        )
+        self.assertEqual(
+            sorted(self._chunk_of(jobs)),
+            sorted(
+                (target, json.dumps(static_config["labels"]))
+                for static_config in self.probe["static_configs"]
+                for target in static_config["targets"]
+            ),
+        )
+        for job in jobs:
+            self.assertEqual(job["params"], self.probe["params"])
+            self.assertEqual(job["metrics_path"], "/probe")
+
+    def test_chunks_are_stable(self):
+        # GIVEN a chunked job
+        before = self._chunk_of(self._build(3))
+
+        # WHEN targets are added before and removed from the others, for as many chunks
+        self.probe["static_configs"][0]["targets"].insert(0, "a-new")
+        self.probe["static_configs"][1]["targets"].remove("b1")
+        after = self._chunk_of(self._build(3))
+
+        # THEN the remaining targets stay in the same chunks
+        for target, chunk in after.items():
+            if target in before:
+                self.assertEqual(chunk, before[target])
+
+    def test_chunks_are_balanced(self):
+        # GIVEN a large job
+        targets = [f"10.0.{i // 256}.{i % 256}" for i in range(10000)]
+        self.probe["static_configs"] = [{"targets": targets}]
+
+        # WHEN it is chunked by 100 targets
+        jobs = self._build(100)
+
+        # THEN the chunks are close to the requested size
+        sizes = [len(job["static_configs"][0]["targets"]) for job in jobs]
+        self.assertEqual(sum(sizes), 10000)
+        self.assertEqual(len(sizes), 100)
+        self.assertLess(max(sizes), 150)
+
+    def test_small_jobs_are_left_alone(self):
+        # WHEN a job is built with no limit, or a limit it does not exceed
+        # THEN it keeps its name and targets
+        for limit in (0, 7):
+            (job,) = self._build(limit)
+            self.assertEqual(job["job_name"], "file_job")
+            self.assertEqual(job["static_configs"], self.probe["static_configs"])
+
+
+class TestScrapeTiers(unittest.TestCase):
+    def setUp(self):
+        self.modules = {
+            "icmp": {"prober": "icmp", "timeout": "5s"},
+            "http_2xx": {"prober": "http"},
+            "http_slow": {"prober": "http", "timeout": "20s"},
+        }
+
+    def _build(self, tiers, probes):
+        builder = ScrapeConfigBuilder(
+            "http://blackbox:9115",
+            scrape_tiers=parse_scrape_tiers(tiers),
+            modules=self.modules,
+        )
+        return {
+            job["job_name"]: job
+            for job in builder.build_probes_scraping_jobs(file_probes="", relation_probes=probes)
+        }
+
+    @staticmethod
+    def _probe(name, module, **kwargs):
+        return {"job_name": name, "params": {"module": [module]}, **kwargs}
+
+    def test_tiers_are_matched_by_module_then_prober(self):
+        # GIVEN a tier for the http_2xx module and one for the http prober
+        tiers = "{http_2xx: {scrape_interval: 10s}, http: {scrape_interval: 2m}}"
+        # WHEN jobs of different modules are built
+        jobs = self._build(
+            tiers,
+            [
+                self._probe("fast", "http_2xx"),
+                self._probe("slow", "http_slow"),
+                self._probe("other", "tcp_connect"),
+            ],
+        )
+        # THEN each gets the interval of its tier, if any
+        self.assertEqual(jobs["fast"]["scrape_interval"], "10s")
+        self.assertEqual(jobs["slow"]["scrape_interval"], "2m")
+        self.assertNotIn("scrape_interval", jobs["other"])
+
+    def test_scrape_timeout_exceeds_module_timeout(self):
+        # GIVEN a tier whose timeout is shorter than the icmp module's
+        tiers = "{icmp: {scrape_interval: 3s, scrape_timeout: 2s}}"
+        # WHEN an icmp job is built
+        jobs = self._build(tiers, [self._probe("ping", "icmp")])
+        # THEN the scrape timeout, and the interval with it, are raised past the module's
+        self.assertEqual(jobs["ping"]["scrape_timeout"], "6s")
+        self.assertEqual(jobs["ping"]["scrape_interval"], "6s")
+
+    def test_scrape_interval_is_set_with_the_timeout(self):
+        # GIVEN tiers setting only a timeout, and a module slower than Prometheus' interval
+        self.modules["http_slower"] = {"prober": "http", "timeout": "90s"}
+        tiers = "{icmp: {scrape_timeout: 10s}, http: {scrape_timeout: 10s}}"
+        # WHEN jobs without an interval are built
+        jobs = self._build(
+            tiers, [self._probe("ping", "icmp"), self._probe("slower", "http_slower")]
+        )
+        # THEN they get an explicit interval, of at least their timeout
+        self.assertEqual(jobs["ping"]["scrape_timeout"], "10s")
+        self.assertEqual(jobs["ping"]["scrape_interval"], "60s")
+        self.assertEqual(jobs["slower"]["scrape_timeout"], "91s")
+        self.assertEqual(jobs["slower"]["scrape_interval"], "91s")
+
+    def test_job_values_are_kept(self):
+        # GIVEN a tier for the icmp prober
+        tiers = "{icmp: {scrape_interval: 5m, scrape_timeout: 30s}}"
+        # WHEN an icmp job setting its own interval is built
+        jobs = self._build(tiers, [self._probe("ping", "icmp", scrape_interval="1m")])
+        # THEN its interval is kept, and the missing timeout is taken from the tier
+        self.assertEqual(jobs["ping"]["scrape_interval"], "1m")
+        self.assertEqual(jobs["ping"]["scrape_timeout"], "30s")
+
+    def test_invalid_tiers_are_rejected(self):
+        invalid = ("[icmp]", "{icmp: 5m}", "{icmp: {interval: 5m}}", "{icmp: {scrape_interval: 5}}")
+        for tiers in invalid:
+            with self.subTest(tiers=tiers), self.assertRaises(ValueError):
+                parse_scrape_tiers(tiers)
+
+    def test_durations(self):
+        self.assertEqual(parse_duration("1m30s"), 90)
+        self.assertEqual(parse_duration("500ms"), 0.5)
+        self.assertEqual(format_duration(90), "90s")
+        self.assertEqual(format_duration(1.5), "1500ms")
+
+
+class TestProbeDeduplication(unittest.TestCase):
+    def _build(self, file_probes, relation_probes, deduplicate=True):
+        builder = ScrapeConfigBuilder("http://blackbox:9115", deduplicate=deduplicate)
+        return builder.build_probes_scraping_jobs(
+            file_probes=yaml.safe_dump({"scrape_configs": file_probes}),
+            relation_probes=relation_probes,
+        )
+
+    def test_duplicate_targets_are_probed_once_with_all_labels(self):
+        # GIVEN a target probed by the probes file and by two relations with the same module
+        file_probes = [
+            {
+                "job_name": "file_job",
+                "params": {"module": ["http_2xx"]},
+                "static_configs": [{"targets": ["a", "b"], "labels": {"team": "web"}}],
+            }
+        ]
+        relation_probes = [
+            {
+                "job_name": f"relation_job_{i}",
+                "params": {"module": ["http_2xx"]},
+                "static_configs": [{"targets": ["b", f"c{i}"], "labels": {"app": f"app{i}"}}],
+            }
+            for i in range(2)
+        ]
+
+        # WHEN the jobs are built
+        jobs = self._build(file_probes, relation_probes)
+
+        # THEN the shared target is only kept by the file job, with the union of its labels
+        self.assertEqual(
+            [(job["job_name"], job["static_configs"]) for job in jobs],
+            [
+                (
+                    "file_job",
+                    [
+                        {"targets": ["a"], "labels": {"team": "web"}},
+                        {"targets": ["b"], "labels": {"team": "web", "app": "app0"}},
+                    ],
+                ),
+                ("relation_job_0", [{"targets": ["c0"], "labels": {"app": "app0"}}]),
+                ("relation_job_1", [{"targets": ["c1"], "labels": {"app": "app1"}}]),
+            ],
+        )
+
+    def test_targets_with_different_params_are_kept(self):
+        # GIVEN the same target probed with two different modules
+        file_probes = [
+            {
+                "job_name": f"{module}_job",
+                "params": {"module": [module]},
+                "static_configs": [{"targets": ["a"]}],
+            }
+            for module in ("http_2xx", "icmp")
+        ]
+
+        # WHEN the jobs are built
+        jobs = self._build(file_probes, [])
+
+        # THEN both are probed
+        self.assertEqual([job["job_name"] for job in jobs], ["http_2xx_job", "icmp_job"])
+
+    def test_fully_duplicated_jobs_are_dropped(self):
+        # GIVEN a relation job whose targets are all in the probes file already
+        probe = {"params": {"module": ["icmp"]}, "static_configs": [{"targets": ["a", "a"]}]}
+        file_probes = [{"job_name": "file_job", **probe}]
+
+        # WHEN the jobs are built, with and without deduplication
+        deduplicated = self._build(file_probes, [{"job_name": "relation_job", **probe}])
+        duplicated = self._build(
+            file_probes, [{"job_name": "relation_job", **probe}], deduplicate=False
+        )
+
+        # THEN only the file job is left, listing the target once
+        self.assertEqual(
+            [(job["job_name"], job["static_configs"]) for job in deduplicated],
+            [("file_job", [{"targets": ["a"]}])],
+        )
+        self.assertEqual(len(duplicated), 2)
+
+
 if __name__ == "__main__":
     unittest.main()
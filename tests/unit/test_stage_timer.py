@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+
+from stage_timer import StageTimer
+
+
+class TestStageTimer(unittest.TestCase):
+    def test_durations_are_accumulated_per_stage(self):
+        # GIVEN a timer
+        timer = StageTimer()
+        # WHEN a stage runs twice and another once
+        for name in ("push_config", "update_layer", "push_config"):
+            with timer.stage(name):
+                pass
+        # THEN each stage is reported once, in the order it first ran
+        self.assertEqual(list(timer.durations), ["push_config", "update_layer"])
+        self.assertRegex(timer.summary(), r"^push_config=\d+\.\dms, update_layer=\d+\.\dms$")
+
+    def test_sizes_are_reported(self):
+        # GIVEN a timer
+        timer = StageTimer()
+        # WHEN a stage records the bytes it handled
+        with timer.stage("push_config") as span:
+            timer.record_size("push_config", 1234, span)
+        # THEN the size is part of the summary
+        self.assertIn("(1234B)", timer.summary())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+from unittest.mock import patch
+
+import yaml
+from helpers import k8s_resource_multipatch
+from ops.testing import ExecResult, Harness
+
+from charm import BlackboxExporterCharm
+
+CONFIG = {"modules": {"icmp": {"prober": "icmp"}}}
+
+
+class WorkloadManagerTestCase(unittest.TestCase):
+    @patch("socket.getfqdn", new=lambda *args: "fqdn")
+    @k8s_resource_multipatch
+    @patch("lightkube.core.client.GenericSyncClient")
+    def setUp(self, *unused):
+        self.harness = Harness(BlackboxExporterCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_can_connect("blackbox", True)
+        self.harness.begin()
+        self.workload = self.harness.charm.blackbox_workload
+        self.container = self.harness.charm.container
+
+
+class TestPushConfig(WorkloadManagerTestCase):
+    def test_first_push_writes_config(self):
+        # GIVEN a container without a config file
+        # WHEN a config is pushed
+        written = self.workload.push_config(CONFIG)
+        # THEN the config is written to disk
+        self.assertTrue(written)
+        content = self.container.pull(self.harness.charm._config_path).read()
+        self.assertEqual(yaml.safe_load(content), CONFIG)
+
+    def test_unchanged_config_is_not_pulled_nor_pushed(self):
+        # GIVEN a config that was already pushed
+        self.workload.push_config(CONFIG)
+        # WHEN the same config is pushed again
+        with (
+            patch.object(self.workload._container, "pull") as pull,
+            patch.object(self.workload._container, "push") as push,
+        ):
+            written = self.workload.push_config(CONFIG)
+        # THEN the container is not touched
+        self.assertFalse(written)
+        pull.assert_not_called()
+        push.assert_not_called()
+
+    def test_unknown_digest_falls_back_to_remote_file(self):
+        # GIVEN a config on disk whose digest is not remembered
+        self.workload.push_config(CONFIG)
+        self.workload._stored.config_digest = ""
+        # WHEN the same config is pushed again
+        with patch.object(self.workload._container, "push") as push:
+            written = self.workload.push_config(CONFIG)
+        # THEN the file on disk is found up to date and not rewritten
+        self.assertFalse(written)
+        push.assert_not_called()
+
+    def test_changed_config_is_pushed(self):
+        # GIVEN a config that was already pushed
+        self.workload.push_config(CONFIG)
+        # WHEN a different config is pushed
+        written = self.workload.push_config({"modules": {"tcp_connect": {"prober": "tcp"}}})
+        # THEN the config is rewritten
+        self.assertTrue(written)
+
+
+class TestUpdateLayer(WorkloadManagerTestCase):
+    def test_first_update_replans(self):
+        # GIVEN a container without the blackbox layer
+        # WHEN the layer is updated
+        changed = self.workload.update_layer()
+        # THEN the service is planned and running
+        self.assertTrue(changed)
+        self.assertTrue(self.container.get_service("blackbox").is_running())
+
+    def test_unchanged_layer_is_not_replanned(self):
+        # GIVEN a service already running with the desired layer
+        self.workload.update_layer()
+        # WHEN the layer is updated again
+        with patch.object(self.workload._container, "replan") as replan:
+            changed = self.workload.update_layer()
+        # THEN pebble is not replanned
+        self.assertFalse(changed)
+        replan.assert_not_called()
+
+    def test_stopped_service_is_replanned(self):
+        # GIVEN a service with the desired layer that is not running
+        self.workload.update_layer()
+        self.container.stop("blackbox")
+        # WHEN the layer is updated again
+        changed = self.workload.update_layer()
+        # THEN the service is started again
+        self.assertTrue(changed)
+        self.assertTrue(self.container.get_service("blackbox").is_running())
+
+
+class TestGoRuntimeEnvironment(WorkloadManagerTestCase):
+    def _set_limits(self, limits):
+        with self.harness.hooks_disabled():
+            self.harness.update_config(limits)
+
+    def _environment(self):
+        self.workload.update_layer()
+        service = self.container.get_plan().services["blackbox"]
+        return service.environment
+
+    def test_no_limits_leave_the_runtime_alone(self):
+        # GIVEN no cpu nor memory limit
+        # WHEN the layer is applied
+        # THEN the Go runtime is not tuned
+        self.assertEqual(self._environment(), {})
+
+    def test_limits_size_the_runtime(self):
+        # GIVEN cpu and memory limits
+        self._set_limits({"cpu": "2500m", "memory": "1Gi"})
+        # WHEN the layer is applied
+        # THEN GOMAXPROCS is the whole number of cores, and GOMEMLIMIT keeps some headroom
+        self.assertEqual(self._environment(), {"GOMAXPROCS": "2", "GOMEMLIMIT": "921MiB"})
+
+    def test_fractional_cpu_gets_one_core(self):
+        # GIVEN a cpu limit below one core
+        self._set_limits({"cpu": "250m"})
+        # WHEN the layer is applied
+        # THEN GOMAXPROCS is one
+        self.assertEqual(self._environment(), {"GOMAXPROCS": "1"})
+
+    def test_changed_limits_replan(self):
+        # GIVEN a service running with a memory limit
+        self._set_limits({"memory": "1Gi"})
+        self.workload.update_layer()
+        # WHEN the limit changes
+        self._set_limits({"memory": "2Gi"})
+        # THEN the service is replanned with the new GOMEMLIMIT
+        self.assertTrue(self.workload.update_layer())
+        self.assertEqual(self._environment(), {"GOMEMLIMIT": "1843MiB"})
+
+
+class TestVersionCache(WorkloadManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.execs = 0
+
+        def handler(_):
+            self.execs += 1
+            return ExecResult(stdout="blackbox_exporter, version 0.25.0 (branch: HEAD)")
+
+        self.harness.handle_exec("blackbox", ["blackbox_exporter", "--version"], handler=handler)
+        self.container.push("/bin/blackbox_exporter", "binary", make_dirs=True)
+
+    def test_version_is_cached_for_the_same_image(self):
+        # GIVEN the version was fetched once
+        self.assertEqual(self.workload._blackbox_exporter_version, "0.25.0")
+        # WHEN it is fetched again with the same workload image
+        version = self.workload._blackbox_exporter_version
+        # THEN the cached version is returned without exec-ing into the container
+        self.assertEqual(version, "0.25.0")
+        self.assertEqual(self.execs, 1)
+
+    def test_version_is_refreshed_when_the_image_changes(self):
+        # GIVEN the version was fetched once
+        self.assertEqual(self.workload._blackbox_exporter_version, "0.25.0")
+        # WHEN the workload image ships a different binary
+        self.container.push("/bin/blackbox_exporter", "a newer binary")
+        self.workload._blackbox_exporter_version
+        # THEN the version is fetched again
+        self.assertEqual(self.execs, 2)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+from unittest.mock import patch
+
+import yaml
+
+import yaml_codec
+
+
+class TestYamlCodec(unittest.TestCase):
+    def setUp(self):
+        self.config = {"modules": {"http_2xx": {"prober": "http", "timeout": "5s"}, "a": [1, 2]}}
+
+    def test_rendering_matches_pure_python(self):
+        # WHEN a config is rendered
+        rendered = yaml_codec.safe_dump(self.config)
+        # THEN it is the same document the pure-Python dumper renders
+        self.assertEqual(
+            rendered, yaml.safe_dump(self.config, sort_keys=True, default_flow_style=False)
+        )
+        self.assertEqual(yaml_codec.safe_load(rendered), self.config)
+
+    def test_falls_back_to_pure_python(self):
+        # GIVEN a PyYAML built without the LibYAML bindings
+        with patch.object(yaml_codec, "SafeLoader", yaml.SafeLoader), patch.object(
+            yaml_codec, "SafeDumper", yaml.SafeDumper
+        ):
+            # WHEN a config is rendered and parsed back
+            parsed = yaml_codec.safe_load(yaml_codec.safe_dump(self.config))
+        # THEN it round-trips
+        self.assertEqual(parsed, self.config)
+
+    def test_invalid_yaml_raises(self):
+        # WHEN an invalid document is parsed
+        # THEN the usual YAML error is raised
+        with self.assertRaises(yaml_codec.YAMLError):
+            yaml_codec.safe_load("modules: [")